@@ -3,13 +3,17 @@ import importlib
 import os
 import sys
 import threading
+import time
 import traceback
 
 base_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, base_dir)
+import_times = {}  # seconds spent importing at Fusion's startup, reported by /status
 
 try:
+    start = time.perf_counter()
     import server
+    import_times["server"] = round(time.perf_counter() - start, 6)
 except Exception:
     adsk.core.Application.get().userInterface.messageBox("Loading failed:\n" + traceback.format_exc())
 
@@ -23,12 +27,15 @@ def import_module(path:str):
 try:
     # import utils module early to keep it from colliding with the select
     # module needed by http.server
+    start = time.perf_counter()
     import_module(os.path.join(base_dir, "routes", "_utils_.py"))
+    import_times["_utils_"] = round(time.perf_counter() - start, 6)
 except Exception:
     adsk.core.Application.get().userInterface.messageBox("Loading modules failed:\n" + traceback.format_exc())
 
 app = None
 handlers = []
+app_events = []  # (event, handler) pairs removed again on stop
 server_thread: threading.Thread|None = None
 
 class RestartHandler(adsk.core.CustomEventHandler):
@@ -61,13 +68,25 @@ def register_event_handler(event_id:str, on_event):
     customEvent.add(on_event)
     handlers.append(on_event)
 
+def add_event_handler(event, on_event):
+    event.add(on_event)
+    app_events.append((event, on_event))
+
 def run(context):
     global app, server_thread
     app = adsk.core.Application.get()
+    server.routes.import_times.update(import_times)
 
     register_event_handler('FusionHeadless.ExecOnUiThread', server.ExecOnUiThreadHandler())
     register_event_handler('FusionHeadless.Restart', RestartHandler())
 
+    # document changes invalidate the server's result cache and are streamed by /events
+    add_event_handler(app.documentOpened, server.DocumentChangedHandler("opened"))
+    add_event_handler(app.documentActivated, server.DocumentChangedHandler("activated"))
+    add_event_handler(app.documentSaved, server.DocumentChangedHandler("saved"))
+    add_event_handler(app.documentClosed, server.DocumentChangedHandler("closed"))
+    add_event_handler(app.userInterface.commandTerminated, server.CommandTerminatedHandler())
+
     try:
         server_thread = threading.Thread(target=server.start_server, daemon=True)
         server_thread.start()
@@ -76,6 +95,9 @@ def run(context):
 
 def stop(context):
     global server_thread
+    for event, on_event in app_events:
+        event.remove(on_event)
+    app_events.clear()
     if server_thread and server_thread.is_alive():
         try:
             server.stop_server()
@@ -5,6 +5,6 @@ import term
 import methods
 from my_printer import pprint, pprint_hook
 
-def initialize(host:str, port:int):
+def initialize(host:str, port:int, unix_socket:str=None):
     term.initialize(host, port)
-    methods.initialize(host, port)
\ No newline at end of file
+    methods.initialize(host, port, unix_socket)
\ No newline at end of file
@@ -1,6 +1,12 @@
+import gzip
+import hashlib
 import http.client
 import json
 import re
+import socket
+import sys
+import time
+import zlib
 from urllib.parse import parse_qs, urlencode, urlparse
 from Exceptions import raise_error
 from ContextVariable import ContextVariable
@@ -9,11 +15,136 @@ from term import Term
 
 host = None
 port = None
-headers = {'Content-Type': 'application/json'}
-def initialize(host_value, port_value):
-    global host, port
+unix_socket = None
+headers = {'Content-Type': 'application/json', 'Accept-Encoding': 'gzip, deflate'}
+connection = None
+uploaded_scripts = set()
+log_timing = False
+last_timing = None
+etags = {}  # path -> (ETag, body) of the last 200 JSON response of routes supporting conditional GET
+MAX_ETAGS = 64
+ARTIFACT_RESUMES = 5  # Range requests made to finish an interrupted download before giving up
+def initialize(host_value, port_value, unix_socket_value=None):
+    global host, port, unix_socket
     host = host_value
     port = port_value
+    unix_socket = unix_socket_value
+    close()
+
+def new_connection(timeout):
+    if unix_socket:
+        return UnixHTTPConnection(unix_socket, timeout=timeout)
+    return http.client.HTTPConnection(host, port, timeout=timeout)
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection to a server listening on a Unix domain socket (server.UNIX_SOCKET)."""
+    def __init__(self, path, timeout=60):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+def close():
+    global connection
+    if connection:
+        connection.close()
+        connection = None
+
+def request(method, path, body=None, timeout=60, extra_headers=None):
+    """Sends a request over a persistent HTTP/1.1 connection, reconnecting once if the server closed it.
+    Only requests sent on a reused keep-alive connection are retried: a request that failed on a fresh
+    connection may already have run on the server, and /exec or /jobs must not run twice."""
+    global connection
+    for attempt in range(2):
+        if connection is None:
+            connection = new_connection(timeout)
+        connection.timeout = timeout
+        reused = connection.sock is not None
+        if reused:
+            connection.sock.settimeout(timeout)
+        try:
+            start = time.monotonic()
+            connection.request(method, path, body=body, headers=dict(headers, **(extra_headers or {})))
+            resp = connection.getresponse()
+            if resp.status == 200 and resp.headers.get('X-Artifact-Id'):
+                resp_data = read_artifact(resp, timeout)
+            else:
+                resp_data = decode(resp, resp.read())
+            timing(method, path, resp, time.monotonic() - start)
+        except (http.client.RemoteDisconnected, http.client.CannotSendRequest, ConnectionResetError, BrokenPipeError):
+            close()
+            if attempt == 1 or not reused:
+                raise
+            continue
+        if resp.will_close:
+            close()
+        return resp, resp_data
+
+def read_artifact(resp, timeout):
+    """Reads and decodes a download the server keeps as an artifact (e.g. /export). If the transfer breaks, the rest is
+    fetched from /artifacts with Range requests instead of having Fusion produce the file again. A compressed download
+    is decoded as it arrives, so it resumes at the decoded size; ranges are always sent uncompressed."""
+    global connection
+    artifact = resp.headers['X-Artifact-Id']
+    encoding = resp.headers.get('Content-Encoding', '').lower()
+    size = None if encoding else int(resp.headers['Content-Length'])  # compressed downloads are chunked
+    decoder = zlib.decompressobj(31 if encoding == 'gzip' else 15) if encoding in ('gzip', 'deflate') else None
+    data = bytearray()
+    for attempt in range(ARTIFACT_RESUMES + 1):
+        try:
+            while chunk := resp.read(1024 * 1024):
+                data += decoder.decompress(chunk) if decoder else chunk
+            if size is None:
+                return bytes(data)  # the chunked body ended cleanly
+        except (http.client.IncompleteRead, OSError) as e:
+            partial = getattr(e, 'partial', b'')
+            data += decoder.decompress(partial) if decoder else partial
+        if size is not None and len(data) >= size:
+            return bytes(data)
+        if attempt == ARTIFACT_RESUMES:
+            break
+        close()
+        print(Term.italic(f"Download interrupted at {len(data)} of {size or 'unknown'} bytes, resuming artifact {artifact}"), file=sys.stderr)
+        try:
+            connection = new_connection(timeout)
+            connection.request('GET', f'/artifacts?id={artifact}', headers=dict(headers, Range=f'bytes={len(data)}-'))
+            resp = connection.getresponse()
+        except OSError:
+            time.sleep(1)
+            continue
+        if resp.status == 416 and resp.headers.get('Content-Range') == f'bytes */{len(data)}':
+            resp.read()
+            return bytes(data)  # a compressed download broke off after its last byte
+        if resp.status != 206:
+            raise ConnectionError(f"Resuming artifact {artifact} failed with {resp.status} {resp.reason}: {resp.read()[:200]!r}")
+        size = int(resp.headers['Content-Range'].rsplit('/', 1)[1])
+        decoder = None
+    raise ConnectionError(f"Download of artifact {artifact} failed after {ARTIFACT_RESUMES} attempts to resume it.")
+
+def timing(method, path, resp, elapsed):
+    """Records the server's phases (Server-Timing) next to the client-side total, printed if log_timing is set."""
+    global last_timing
+    phases = {}
+    for item in resp.headers.get('Server-Timing', '').split(','):
+        name, _, params = item.strip().partition(';')
+        match = re.search(r'dur=([0-9.]+)', params)
+        if name and match:
+            phases[name] = float(match.group(1))
+    last_timing = {"request_id": resp.headers.get('X-Request-Id'), "phases": phases, "total": round(elapsed * 1000, 3)}
+    if log_timing:
+        breakdown = ", ".join(f"{name} {ms:.1f}ms" for name, ms in phases.items())
+        print(Term.italic(f"{method} {path.split('?')[0]} [{last_timing['request_id']}] {breakdown}, total {last_timing['total']:.1f}ms"), file=sys.stderr)
+
+def decode(resp, resp_data):
+    encoding = resp.headers.get('Content-Encoding', '').lower()
+    if encoding == 'gzip':
+        return gzip.decompress(resp_data)
+    elif encoding == 'deflate':
+        return zlib.decompress(resp_data)
+    return resp_data
 
 def get(endpoint, params:dict=None, timeout=60):
     path = endpoint if endpoint.startswith('/') else f"/{endpoint}"
@@ -24,19 +155,19 @@ def get(endpoint, params:dict=None, timeout=60):
             query = urlencode(params, True)
         path += f"?{query}"
 
-    conn = http.client.HTTPConnection(host, port, timeout=timeout)
-    conn.request('GET', path, headers=headers)
-    resp = conn.getresponse()
-    resp_data = resp.read()
-    conn.close()
-
-    if resp.status != 200:
-        return raise_error(resp.status, resp.reason, resp_data)
-
-    if resp.headers.get('Content-Type', '') == 'application/json':
+    cached = etags.get(path)
+    resp, resp_data = request('GET', path, timeout=timeout, extra_headers={'If-None-Match': cached[0]} if cached else None)
+    if resp.status == 304 and cached:
+        resp_data = cached[1]  # unchanged since the last poll, the server sent no body
         return json.loads(resp_data.decode())
-    else:
-        return resp_data
+    etags.pop(path, None)
+    # only JSON results are kept; artifact downloads (e.g. /export) also carry an ETag but may be huge
+    if resp.status == 200 and resp.headers.get('ETag') and resp.headers.get_content_type() == 'application/json' \
+            and not resp.headers.get('X-Artifact-Id'):
+        etags[path] = (resp.headers['ETag'], resp_data)
+        while len(etags) > MAX_ETAGS:
+            del etags[next(iter(etags))]
+    return response_data(resp, resp_data)
 
 def post(endpoint, data:dict=None, file_path_hint=None, timeout=60):
     path = endpoint if endpoint.startswith('/') else f"/{endpoint}"
@@ -47,19 +178,24 @@ def post(endpoint, data:dict=None, file_path_hint=None, timeout=60):
     else:
         body = json.dumps(data)
 
-    conn = http.client.HTTPConnection(host, port, timeout=timeout)
-    conn.request('POST', path, body=body, headers=headers)
-    resp = conn.getresponse()
-    resp_data = resp.read()
-    conn.close()
+    resp, resp_data = request('POST', path, body=body, timeout=timeout)
+    return response_data(resp, resp_data, file_path_hint)
 
-    if resp.status != 200:
+def job(endpoint, data:dict=None, file_path_hint=None, timeout=60, poll=1.0):
+    """Runs a long request such as /render or /export as a server-side job: submits it to /jobs, then polls until
+    the result is ready, so no single request stays open for minutes (and runs into proxy timeouts)."""
+    path = endpoint if endpoint.startswith('/') else f"/{endpoint}"
+    resp, resp_data = request('POST', '/jobs', body=json.dumps({"path": path, "query": data or {}}), timeout=timeout)
+    if resp.status != 202:
         return raise_error(resp.status, resp.reason, resp_data, file_path_hint)
-
-    if resp.headers.get('Content-Type', '') == 'application/json':
-        return json.loads(resp_data.decode())
-    else:
-        return resp_data
+    key = json.loads(resp_data.decode())['result']['id']
+    while True:
+        resp, resp_data = request('GET', f'/jobs?id={key}&result=1', timeout=timeout)
+        if resp.status != 202:
+            # the server keeps finished jobs until they expire, drop this one now that its result is here
+            request('POST', '/jobs', body=json.dumps({"cancel": key}), timeout=timeout)
+            return response_data(resp, resp_data, file_path_hint)
+        time.sleep(poll)
 
 def file(file):
     result: dict|list[dict] = None
@@ -77,6 +213,32 @@ def file(file):
             raise TypeError("Incompatible data types: cannot merge dict and list or vice versa.")
     return result
 
+def exec_script(code, call, file_path_hint=None, timeout=60):
+    """Runs code followed by call via /exec. The script is uploaded to /scripts once and then referenced by its hash."""
+    script = hashlib.sha256(code.encode()).hexdigest()
+    body = json.dumps({"script": script, "code": call})
+    if script in uploaded_scripts:
+        resp, resp_data = request('POST', '/exec', body=body, timeout=timeout)
+        if resp.status != 404:
+            return response_data(resp, resp_data, file_path_hint)
+        uploaded_scripts.discard(script)  # evicted or the server restarted
+
+    uploaded = post("/scripts", {"code": code}, file_path_hint=file_path_hint, timeout=timeout)
+    if not isinstance(uploaded, dict):
+        return uploaded  # upload failed, e.g. a syntax error, already reported by raise_error
+    uploaded_scripts.add(script)
+    resp, resp_data = request('POST', '/exec', body=body, timeout=timeout)
+    return response_data(resp, resp_data, file_path_hint)
+
+def response_data(resp, resp_data, file_path_hint=None):
+    if resp.status != 200:
+        return raise_error(resp.status, resp.reason, resp_data, file_path_hint)
+
+    if resp.headers.get('Content-Type', '') == 'application/json':
+        return json.loads(resp_data.decode())
+    else:
+        return resp_data
+
 def test(file_path, query = {}, output=None, timeout=60):
     global suppress_errors
     suppress_errors = True
@@ -89,7 +251,7 @@ def test(file_path, query = {}, output=None, timeout=60):
     def_handle = [i for i in code.splitlines() if re.match(r'def\s*handle\s*\(', i)][0]
     def_handle_params = [i.split(':')[0].strip(' ,)') for i in re.findall(r'([^,()]+\s*[,)])', def_handle)]
     for i in def_handle_params:
-        if i in ('app', 'adsk', 'ui', 'os', 'sys', 'status'):
+        if i in ('app', 'adsk', 'ui', 'os', 'sys', 'status', 'yield_ui', 'job'):
             # If the context variable is one of these, we assume it's already defined
             context[i] = ContextVariable(i)
         elif i == 'query':
@@ -98,19 +260,11 @@ def test(file_path, query = {}, output=None, timeout=60):
             elif isinstance(query, str):
                 parsed = urlparse(query)
                 context["query"] = parse_qs(parsed.query)
-    data = {
-        "code": "\n".join([
-            code,
-            "",
-            f"result = handle(**{repr(context)})"
-        ])
-    }
-
     # lineNo = 0
-    # for line in data['code'].splitlines():
+    # for line in code.splitlines():
     #     lineNo += 1
     #     print(f"{lineNo:4d} │ {line}")
-    response = post("/exec", data, file_path_hint=file_path, timeout=timeout)
+    response = exec_script(code, f"result = handle(**{repr(context)})", file_path_hint=file_path, timeout=timeout)
     
     if output is None:
         pprint(response)
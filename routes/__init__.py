@@ -2,14 +2,32 @@ import importlib
 import importlib.util
 import os
 import sys
+import time
 import types
 
+import_started = time.perf_counter()
 routes = {}
-def register(path:str, handler_func):
+options = {}
+import_times = globals().get("import_times", {})  # sys.modules key -> seconds spent importing, kept across reloads
+def register(path:str, handler_func, **route_options):
+    """Registers a handler, either a function or the name of a route module whose handle() is then imported on
+    the first request; route_options are read by the server, e.g. deadline (seconds),
+    priority (the work queue lane, "interactive", "normal" or "bulk"),
+    etag (True, or a predicate of the query, to answer unchanged GET results with 304),
+    cache (likewise, to keep GET results until Fusion reports a change to the document),
+    artifacts (likewise, to keep returned FileResponses downloadable with Range requests from /artifacts) or
+    http_thread (likewise, for requests that do not use the Fusion API and run without waiting for the UI thread)."""
     routes[path] = handler_func
+    options[path] = route_options
 
 def get_handler(path:str):
-    return routes.get(path, None)
+    handler = routes.get(path, None)
+    if isinstance(handler, str):
+        return getattr(FusionHeadless, handler).handle
+    return handler
+
+def get_options(path:str) -> dict:
+    return options.get(path, {})
 
 class FusionHeadlessModules:
     def __getattr__(self, file:str) -> types.ModuleType:
@@ -19,20 +37,29 @@ class FusionHeadlessModules:
             spec = importlib.util.spec_from_file_location(file, base_path)
             module = importlib.util.module_from_spec(spec)
             sys.path.insert(0, os.path.dirname(base_path))
+            start = time.perf_counter()
             spec.loader.exec_module(module)
+            import_times[key] = round(time.perf_counter() - start, 6)
             sys.path.pop(0)
             sys.modules[key] = module
         return sys.modules[key]
 FusionHeadless = FusionHeadlessModules()
 
-register("/status"     , FusionHeadless.status.handle)
-register("/components" , FusionHeadless.list.handle)
-register("/bodies"     , FusionHeadless.list.handle)
-register("/export"     , FusionHeadless.export.handle)
-register("/projects"   , FusionHeadless.list_projects.handle)
-register("/document"   , FusionHeadless.document.handle)
-register("/files"      , FusionHeadless.files.handle)
-register("/render"     , FusionHeadless.render.handle)
-register("/select"     , FusionHeadless.select.handle)
-register("/parameter"  , FusionHeadless.parameter.handle)
-register("/mcp"        , FusionHeadless.mcp.handle)
\ No newline at end of file
+def mcp_without_fusion(query:dict) -> bool:
+    """MCP handshakes, pings and tool discovery never touch the Fusion API, only tools/call does."""
+    method = str(query.get("method"))
+    return method in ("initialize", "ping", "tools/list") or method.startswith("notifications/")
+
+# route modules are imported on their first request, keeping them out of Fusion's startup
+register("/status"     , "status", http_thread=True)
+register("/components" , "list", etag=True, cache=True)
+register("/bodies"     , "list", etag=True, cache=True)
+register("/export"     , "export", deadline=600, artifacts=True, priority="bulk")
+register("/projects"   , "list_projects", etag=True)
+register("/document"   , "document", deadline=60)
+register("/files"      , "files", etag=True)
+register("/render"     , "render", deadline=240, priority="bulk")
+register("/select"     , "select", priority="interactive")
+register("/parameter"  , "parameter", etag=lambda query: len(query) == 0, cache=lambda query: len(query) == 0, priority="interactive")  # with arguments it sets parameters
+register("/mcp"        , "mcp", http_thread=mcp_without_fusion)
+import_times["routes"] = round(time.perf_counter() - import_started, 6)
\ No newline at end of file
@@ -12,23 +12,64 @@ from http.server import BaseHTTPRequestHandler
 ##    ##  ##       ##    ## ##        ##     ## ##   ### ##    ## ##       ##    ##
 ##     ## ########  ######  ##         #######  ##    ##  ######  ########  ######
 class HttpResponse:
+    chunk_size = 64 * 1024
+
     def __init__(self, status_code: int):
         self.status_code = status_code
         self.headers = { "Content-Type": "text/plain" }
         self.content = ""
 
-    def send_header(self, requestHandler: BaseHTTPRequestHandler):
+    def get_content(self) -> bytes|object:
+        """Returns the body as bytes, or an iterable of bytes to send it chunked."""
+        if isinstance(self.content, str):
+            return self.content.encode()
+        return self.content
+
+    def send_header(self, requestHandler: BaseHTTPRequestHandler, headers: dict = None):
         requestHandler.send_response(self.status_code)
-        for k, v in self.headers.items():
+        for k, v in (headers or self.headers).items():
             requestHandler.send_header(k, v)
         requestHandler.end_headers()
 
-    def send_content(self, requestHandler: BaseHTTPRequestHandler):
-        requestHandler.wfile.write(self.content.encode())
+    def send_content(self, requestHandler: BaseHTTPRequestHandler, content: bytes|object, chunked: bool = False):
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            view = memoryview(content)
+            for i in range(0, len(view), self.chunk_size):
+                requestHandler.wfile.write(view[i:i + self.chunk_size])
+        elif chunked:
+            for chunk in content:
+                if chunk:
+                    requestHandler.wfile.write(b"%X\r\n%s\r\n" % (len(chunk), chunk))
+            if hasattr(requestHandler, "end_chunks"):
+                requestHandler.end_chunks()  # adds the server's trailers, e.g. Server-Timing
+            else:
+                requestHandler.wfile.write(b"0\r\n\r\n")
+        else:
+            for chunk in content:
+                requestHandler.wfile.write(chunk)
 
     def send(self, requestHandler: BaseHTTPRequestHandler):
-        self.send_header(requestHandler)
-        self.send_content(requestHandler)
+        # framing and encoding headers depend on the request, so they go into a copy
+        headers = dict(self.headers)
+        content = self.get_content()
+        if "Content-Encoding" not in headers and hasattr(requestHandler, "encode_body"):
+            # compression is negotiated by the server and happens while sending, on the HTTP thread
+            encoding, content = requestHandler.encode_body(headers.get("Content-Type"), content)
+            if encoding:
+                headers["Content-Encoding"] = encoding
+                headers["Vary"] = "Accept-Encoding"
+
+        chunked = False
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            headers["Content-Length"] = str(len(content))
+        elif requestHandler.request_version == "HTTP/1.1":
+            headers["Transfer-Encoding"] = "chunked"
+            chunked = True
+        else:
+            # HTTP/1.0 clients do not understand chunked bodies, end of body is end of connection
+            requestHandler.close_connection = True
+        self.send_header(requestHandler, headers)
+        self.send_content(requestHandler, content, chunked)
 
 class BinaryResponse(HttpResponse):
     def __init__(self, data: bytes):
@@ -36,17 +77,39 @@ class BinaryResponse(HttpResponse):
         self.headers["Content-Type"] = "application/octet-stream"
         self.content = data
 
-    def send_content(self, requestHandler: BaseHTTPRequestHandler):
-        requestHandler.wfile.write(self.content)
-
 class PngResponse(HttpResponse):
     def __init__(self, data: bytes):
         super().__init__(200)
         self.headers["Content-Type"] = "image/png"
         self.content = data
 
-    def send_content(self, requestHandler: BaseHTTPRequestHandler):
-        requestHandler.wfile.write(self.content)
+class FileResponse(HttpResponse):
+    """A file on disk, e.g. an export, sent by the HTTP thread rather than read on Fusion's UI thread.
+    The server streams it with os.sendfile where possible and the file is deleted afterwards if delete is set."""
+    def __init__(self, path: str, content_type: str = "application/octet-stream", delete: bool = True):
+        super().__init__(200)
+        self.headers["Content-Type"] = content_type
+        self.path = path
+        self.delete = delete
+
+    def send(self, requestHandler: BaseHTTPRequestHandler):
+        try:
+            if hasattr(requestHandler, "send_file"):
+                requestHandler.send_file(self.status_code, dict(self.headers), self.path)
+            else:
+                with open(self.path, "rb") as file:
+                    self.content = iter(lambda: file.read(self.chunk_size), b"")
+                    super().send(requestHandler)
+        finally:
+            self.discard()
+
+    def discard(self):
+        """Deletes the file if it is temporary; also called by the server for results that are never sent."""
+        if self.delete:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
 
 
 ##     ## ######## ##       ########  ######## ########       ######## ##     ## ##    ##  ######  ######## ####  #######  ##    ##  ######
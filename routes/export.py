@@ -8,7 +8,7 @@ exportManager to export the selected item in the requested format (STEP or STL).
 import os
 import tempfile
 import uuid
-from _utils_ import BinaryResponse, setVisibility, Visibility
+from _utils_ import FileResponse, setVisibility, Visibility
 
 def handle(query:dict, app, adsk) -> any:
     if not hasattr(app.activeProduct, "exportManager"):
@@ -67,10 +67,7 @@ def handle(query:dict, app, adsk) -> any:
         raise Exception(f"Unsupported export format: {format}")
 
     exportMgr.execute(exportOptions)
-    with open(exportOptions.filename, 'rb') as file:
-        content = file.read()
-    os.remove(exportOptions.filename)
-    return BinaryResponse(content)
+    return FileResponse(exportOptions.filename)  # read, sent and deleted by the HTTP thread
 
 if __name__ == "__main__":
     from _client_ import *
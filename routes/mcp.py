@@ -38,8 +38,8 @@ class JsonRpcResponse(HttpResponse):
         self.headers["Content-Type"] = "application/json"
         self._data = data
 
-    def send_content(self, requestHandler):
-        requestHandler.wfile.write(json.dumps(self._data).encode())
+    def get_content(self) -> bytes:
+        return json.dumps(self._data).encode()
 
 
 def _get_module(tool_name):
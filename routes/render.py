@@ -14,32 +14,60 @@ Args:
     app: The Fusion 360 application object.
     ui: The Fusion 360 user interface object.
     adsk: The Fusion 360 API module.
+    yield_ui: Runs queued interactive requests while waiting for the render.
+    job: The job when submitted to /jobs (else None), to report progress and stop waiting once cancelled.
 
 Returns:
-    PngResponse: The rendered image as a PNG response.
+    FileResponse: The rendered PNG image, sent and deleted by the HTTP thread.
+    HttpResponse: 409 if the job was cancelled before the image was written.
 
 Raises:
     ValueError: If the quality value is out of the allowed range.
     Exception: If rendering does not complete within the specified timeout.
 """
 
-import asyncio
 import math
 import os
 import tempfile
+import threading
+import time
 import uuid
-from _utils_ import PngResponse, setControlDefinition, setVisibility, Visibility
-
-
-def handle(query:dict, app, ui, adsk) -> any:
+from _utils_ import FileResponse, HttpResponse, setControlDefinition, setVisibility, Visibility
+
+
+def discard_when_written(path:str, timeout:float=600):
+    """Deletes the PNG of a render that was abandoned, once Fusion writes it; a started local render cannot be stopped."""
+    def wait():
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(1)
+            if os.path.exists(path):
+                time.sleep(1)  # let Fusion finish writing it
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                return
+    threading.Thread(target=wait, daemon=True).start()
+
+
+def handle(query:dict, app, ui, adsk, yield_ui, job) -> any:
     path = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4().hex}.png")
     if os.path.exists(path):
         os.remove(path)
 
-    async def render_finished(path):
-        while not os.path.exists(path):
+    def render_finished(path, timeout:float) -> bool:
+        # a plain loop rather than asyncio.run: interactive requests run by yield_ui may start an event loop themselves
+        started = time.monotonic()
+        while not os.path.exists(path) and not (job and job.cancelled):
+            if time.monotonic() - started > timeout:
+                return False
             adsk.doEvents()
-            await asyncio.sleep(1)
+            yield_ui()  # run interactive requests queued meanwhile, e.g. /select
+            if job:
+                job.progress(message=f"Rendering for {time.monotonic() - started:.0f} seconds")
+            time.sleep(1)
+        return True
 
     quality, visualStyle = {
         'Shaded'                        : (None, 0),
@@ -146,19 +174,20 @@ def handle(query:dict, app, ui, adsk) -> any:
 
         render.startLocalRender(path, camera)
 
-    try:
-        asyncio.run(asyncio.wait_for(render_finished(path), timeout=180))
-    except asyncio.TimeoutError:
+    if not render_finished(path, timeout=180):
+        discard_when_written(path)
         raise Exception("Failed to render within 180 seconds.")
 
     viewport.visualStyle = old['visualStyle']
     setControlDefinition('VisibilityOverrideCommand', old.get('visibility'), adsk, ui)
     setControlDefinition('ViewCameraCommand', old.get('camera'), adsk, ui)
 
-    with open(path, 'rb') as file:
-        content = file.read()
-    os.remove(path)
-    return PngResponse(content)
+    if not os.path.exists(path):
+        discard_when_written(path)
+        response = HttpResponse(409)
+        response.content = "Render cancelled."
+        return response
+    return FileResponse(path, "image/png")
 
 if __name__ == "__main__":
     import _client_
@@ -15,17 +15,19 @@ def get_uptime(startup_time:datetime.datetime) -> str:
     else:
         return f"{uptime.total_seconds():0.0f} seconds"
 
-def handle(app, status:dict) -> any:
-    # copy status to result, except startup_time
+def handle(status:dict) -> any:
+    # runs off the UI thread, Fusion's version and paths were read by the server on the UI thread
+    # copy status to result, except startup_time and fusion
     result = {
         "status": "Server is running",
         "uptime": get_uptime(status['startup_time']),
-        "version": f"Autodesk Fusion v{app.version}",
+        "version": f"Autodesk Fusion v{status['fusion'].get('version')}",
         "python": sys.version,
-        "paths" : {k: getattr(app.applicationFolders, k) for k in dir(app.applicationFolders) if not k.startswith('_') and 'path' in k.lower()},
+        "paths" : status['fusion'].get('paths', {}),
     }
     result.update(status)
     del result['startup_time']
+    del result['fusion']
     return result
 
 if __name__ == "__main__":
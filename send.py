@@ -6,13 +6,14 @@ import json, os, sys
 
 import jmespath
 import cli
-from cli.methods import get, post, file
+from cli.methods import get, post, file, job
 from cli.match_with_files import match_with_files
 from cli.EvalHelper import EvalDict, EvalList 
 
 host = 'localhost'
 port = 5000
-cli.initialize(host, port)
+unix_socket = os.environ.get('FUSIONHEADLESS_SOCKET')  # e.g. /tmp/FusionHeadless.sock, see server.UNIX_SOCKET
+cli.initialize(host, port, unix_socket)
 
 def output(result, path:str, verbose:bool=False):
     if os.path.exists(path):
@@ -47,8 +48,12 @@ def main():
     parser.add_argument('--file', "-f", action='append', type=argparse.FileType('r', encoding='utf-8'), help='Reads response/data from a file.')
     parser.add_argument('--data', "-d", type=str, help='JSON data to send with POST request.')
     parser.add_argument('--jmespath', "-j", action='append', help='JMESPath to extract data from the response.')
+    parser.add_argument('--select', "-S", type=str, help='Fields to keep, applied by the server before serialization (e.g. "*.name,*.volume").')
     parser.add_argument('--eval', "-py", action='append', help='Python expression to evaluate on the response data. Use @ to access the response.')
     parser.add_argument('--timeout', "-t", type=int, default=60, help='Timeout for the request in seconds.')
+    parser.add_argument('--unix-socket', "-U", type=str, help='Connect through this Unix domain socket instead of TCP (default: $FUSIONHEADLESS_SOCKET).')
+    parser.add_argument('--job', action='store_true', help='Run the request as a server-side job and poll for its result (for long renders and exports).')
+    parser.add_argument('--timing', action='store_true', help='Print the server-side latency breakdown (Server-Timing) of each request to stderr.')
 
     parser.add_argument('--match-with-files', "-m", type=str, help='Find files in a folder and match them with the response.')
     parser.add_argument('--base-material', type=str, help='Base material for matching files.')
@@ -71,6 +76,10 @@ def main():
 
     if not args.silent:
         sys.addaudithook(cli.pprint_hook)
+    if args.timing:
+        cli.methods.log_timing = True
+    if args.unix_socket:
+        cli.initialize(host, port, args.unix_socket)
 
     data = {}
     if args.file and (args.get or args.post):
@@ -78,9 +87,13 @@ def main():
         data.update(items)
     if args.data:
         data.update(json.loads(args.data))
+    if args.select:
+        data['select'] = args.select
 
     result = None
-    if args.get:
+    if args.job and (args.get or args.post):
+        result = job(args.get or args.post, data, timeout=args.timeout)
+    elif args.get:
         result = get(args.get, data, timeout=args.timeout)
     elif args.post:
         result = post(args.post, data, timeout=args.timeout)
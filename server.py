@@ -2,19 +2,109 @@ from datetime import datetime
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import urlparse, parse_qs
 import adsk.core # type: ignore
+import asyncio
+import collections
+import collections.abc
+import concurrent.futures
+import cProfile
+import hashlib
+import http.client
 import importlib
+import io
+import itertools
 import json
+import math
 import os
+import pstats
+import re
 import routes
+import shutil
+import socket
+import stat
 import sys
+import tempfile
 import threading
+import time
 import traceback
+import types
 import uuid
+import zlib
 
 
+SERVER_CORE = "asyncio"  # "asyncio" or "threading" (one thread per connection)
+UNIX_SOCKET = None  # path of a Unix domain socket served alongside (or, with port None, instead of) TCP; asyncio core, not on Windows
+UNIX_SOCKET_MODE = 0o600  # file permissions of the socket, i.e. which local users may connect
+ASYNC_SEND_WORKERS = 16  # threads the asyncio core borrows for writing responses
+ASYNC_DIRECT_WORKERS = 8  # threads the asyncio core runs http_thread routes, /artifacts and /jobs on, apart from response writes
+KEEP_ALIVE_TIMEOUT = 30
+KEEP_ALIVE_MAX_REQUESTS = 1000
+DRAIN_TIME_BUDGET = 0.05  # seconds of UI-thread time one custom event may spend draining the work queue
+STREAM_BUFFER_SIZE = 64 * 1024  # JSON responses larger than this are sent chunked while being encoded
+STREAM_BATCH_SIZE = 500  # items pulled from a streamed generator per UI-thread dispatch
+STREAM_ENCODE_BATCH = 256  # list items or dict entries passed to the C encoder per call while streaming JSON
+COMPRESS_MIN_SIZE = 1024  # bodies smaller than this are sent uncompressed
+COMPRESS_LEVEL = 6
+SENDFILE_MIN_SIZE = 1024 * 1024  # FileResponse bodies from this size on are streamed from disk, with os.sendfile unless compressed
+COMPRESSED_TYPES = ("image/png", "image/jpeg", "application/zip", "application/gzip", "model/3mf")
+COMPRESSED_MAGIC = (b"\x89PNG", b"PK\x03\x04", b"\x1f\x8b", b"\xff\xd8\xff")  # png, zip (3mf, f3d), gzip, jpeg
+MAX_QUEUE_DEPTH = 64  # requests waiting for the UI thread per priority lane beyond this are rejected with 503
+PRIORITIES = ("interactive", "normal", "bulk")  # work queue lanes, drained in this order; set by routes.register(..., priority=) or X-Priority
+PRIORITY_AGING = 30  # seconds after which a waiting request runs next regardless of its lane, so bulk work is not starved
+DEFAULT_DEADLINE = 120  # seconds, overridden per route by routes.register(..., deadline=) or the X-Deadline header
+BUILTIN_ROUTES = {  # paths served by the server itself, with route options as routes.register takes them; job: may run as /jobs
+    "/eval": {"job": True},
+    "/exec": {"deadline": 600, "job": True},
+    "/batch": {"deadline": 600, "job": True},
+    "/restart": {},
+    "/reload": {},
+    "/scripts": {"http_thread": True},
+    "/sessions": {"http_thread": True},
+    "/profiles": {"http_thread": True},
+    "/metrics": {},
+    "/events": {},
+    "/artifacts": {},
+    "/jobs": {},
+}
+RETRY_AFTER = 5  # seconds suggested to clients on 503/504
+MAX_CONNECTIONS = 256  # concurrent connections beyond this are answered with 503 and closed
+PLAN_FAILURE_THRESHOLD = 3  # attributes raising on this many instances of a type (and never succeeding) are skipped for the rest of that conversion
+MAX_SCRIPTS = 256  # uploaded script sources kept by content hash
+MAX_COMPILED_SCRIPTS = 128  # compiled code objects kept for /eval and /exec
+MAX_SESSIONS = 16  # named /eval and /exec namespaces; the least recently used is closed beyond this
+SESSION_TTL = 900  # seconds a session may stay idle before it is closed
+PROFILE_TOP = 30  # functions by cumulative time reported by ?profile=1, overridable with profileTop
+MAX_PROFILES = 32  # profiles kept for /profiles; older ones and their pstats dumps are dropped
+PROFILE_DIR = os.path.join(tempfile.gettempdir(), "FusionHeadless-profiles")
+ARTIFACT_DIR = os.path.join(tempfile.gettempdir(), "FusionHeadless-artifacts")
+ARTIFACT_TTL = 600  # seconds the files of routes registered with artifacts=True stay downloadable from /artifacts
+MAX_ARTIFACTS = 32
+ARTIFACT_MAX_BYTES = 4 * 1024 * 1024 * 1024  # the oldest artifacts are dropped beyond this
+MAX_JOBS = 64  # queued, running and finished /jobs kept; submissions beyond this are rejected with 503
+JOB_TTL = 600  # seconds a finished job's result is kept for /jobs?id=<id>&result=1
+ADDIN_DIR = os.path.dirname(os.path.abspath(__file__))  # modules loaded from here are candidates for /reload
+CACHE_MAX_BYTES = 64 * 1024 * 1024  # encoded results kept for routes registered with cache=True
+NON_MODIFYING_COMMANDS = ("SelectCommand", "PanCommand", "OrbitCommand", "FreeOrbitCommand", "ZoomCommand", "FitCommand")
+EVENT_TYPES = ("opened", "activated", "saved", "closed", "command", "request")  # streamed by /events
+EVENT_BUFFER_SIZE = 256  # events kept per /events client that has not read them yet; older ones are dropped
+EVENT_HISTORY = 1024  # recent events replayed to clients reconnecting with Last-Event-ID
+MAX_EVENT_CLIENTS = 32  # concurrent /events streams beyond this are rejected with 503
+EVENT_HEARTBEAT = 15  # seconds between keep-alive comments on an idle /events stream
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 600)  # histogram upper bounds in seconds
+
 startup_time = datetime.now()
 app = None
 ui = None
+fusion_info = {}  # read on the UI thread, so /status can answer without it
+def describe_fusion():
+    global app
+    if app is None:
+        app = adsk.core.Application.get()
+    folders = app.applicationFolders
+    fusion_info.update({
+        "version": app.version,
+        "paths": {k: getattr(folders, k) for k in dir(folders) if not k.startswith('_') and 'path' in k.lower()},
+    })
+
 def get_context(additional={}):
     global app, ui, startup_time
     if app is None:
@@ -27,14 +117,46 @@ def get_context(additional={}):
         "os"   : os,
         "sys"  : sys,
         "ui"   : ui,
-        "status": {
-            "startup_time": startup_time,
-            "routes": sorted(["/eval", "/exec", "/restart", "/reload"] + [x for x in routes.routes.keys()])
-        }
+        "yield_ui": yield_ui_thread,
+        "job": None,  # the Job when running as one, see /jobs
+        "status": ServerStatus(),
     }
     context.update(additional)
     return context
 
+class ServerStatus(collections.abc.Mapping):
+    """The server state reported by /status. It is built on first access, so the requests that do not
+    read it (including /batch sub-requests) do not take the locks of every store for it."""
+    def __init__(self):
+        self.data = None
+
+    def snapshot(self) -> dict:
+        if self.data is None:
+            self.data = {
+                "startup_time": startup_time,
+                "fusion": dict(fusion_info),
+                "routes": sorted([*BUILTIN_ROUTES, *routes.routes.keys()]),
+                "queue": work_queue.stats(),
+                "object2json": dict(object2json_stats),
+                "scripts": script_registry.stats(),
+                "sessions": sessions.stats(),
+                "cache": result_cache.stats(),
+                "events": event_bus.stats(),
+                "artifacts": artifacts.stats(),
+                "jobs": jobs.stats(),
+                "imports": dict(routes.import_times),
+            }
+        return self.data
+
+    def __getitem__(self, key):
+        return self.snapshot()[key]
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __len__(self):
+        return len(self.snapshot())
+
 def sort_attrs(item):
     order = ["id", "name", "description"]
     if item in order:
@@ -42,60 +164,274 @@ def sort_attrs(item):
     else:
         return f"{len(order):02d}_{item}"
 
-def object2json(obj, max_depth, depth=0):
-    if type(obj).__name__ in ['method', 'function', 'NoneType']:
-        result = None
-    elif isinstance(obj, (int, float, str, bool)):
-        result = obj
-    elif obj is None:
-        result = None
-    elif isinstance(obj, (list, tuple)):
-        result = [object2json(x, max_depth, depth+1) for x in obj] if depth < max_depth else []
-    elif isinstance(obj, dict):
-        result = {k: object2json(v, max_depth, depth+1) for k, v in obj.items()} if depth < max_depth else {}
-    elif hasattr(obj, 'asArray') and callable(obj.asArray):
-        result = [object2json(v, max_depth, depth+1) for v in obj.asArray()] if depth < max_depth else []
-    elif hasattr(obj, 'asDict') and callable(obj.asDict):
-        result = {k: object2json(v, max_depth, depth+1) for k, v in obj.asDict().items()} if depth < max_depth else {}
-    elif hasattr(obj, '__iter__') and callable(obj.__iter__):
-        result = {k: object2json(v, max_depth, depth+1) for k, v in obj} if depth < max_depth else {}
-    else:
-        result = {k: object2json(attribute2json(obj, k), max_depth, depth+1) for k in sorted(dir(obj), key=sort_attrs) if not k.startswith('_')}  if depth < max_depth else {}
+def parse_select(select:str|list|None) -> dict|None:
+    """Parses a field projection such as "id,name,bodies.{name,volume},*.mass" into a tree
+    {field: subtree}, where a subtree of None keeps the whole value. Supported is a JMESPath-like
+    subset: dotted paths, "*" for every key, "{a,b}" groups; "[]"/"[*]" are accepted and ignored
+    since lists are always projected element-wise."""
+    if select is None or select == "" or select == []:
+        return None
+    text = ",".join(select) if isinstance(select, list) else str(select)
+    tokens = re.findall(r"\[\*?\]|[.,{}]|[^.,{}\[\]\s]+|\S", text)
+    pos = 0
 
-    # Check if the object's type is a built-in type
-    if isinstance(type(obj), type) and type(obj).__module__ == 'builtins':
-        pass
-    elif isinstance(result, (list, tuple)):
-        result = {
-            'items': [x for x in result if x is not None],
-            'objectType': f"https://help.autodesk.com/view/fusion360/ENU/?cg=Developer%27s%20Documentation&query={type(obj).__name__}%20Object",
-        }
-    elif isinstance(result, dict):
-        result.update({
-            'objectType': f"https://help.autodesk.com/view/fusion360/ENU/?cg=Developer%27s%20Documentation&query={type(obj).__name__}%20Object",
-        })
-        result = {k: v for k, v in result.items() if v is not None}
+    def parse_group(tree:dict):
+        nonlocal pos
+        while True:
+            parse_path(tree)
+            if pos < len(tokens) and tokens[pos] == ",":
+                pos += 1
+            else:
+                return
 
-    return result
+    def parse_path(tree:dict):
+        nonlocal pos
+        if pos < len(tokens) and tokens[pos] in ("[]", "[*]"):
+            while pos < len(tokens) and tokens[pos] in ("[]", "[*]"):
+                pos += 1
+            if pos < len(tokens) and tokens[pos] == ".":
+                pos += 1
+        if pos < len(tokens) and tokens[pos] == "{":
+            pos += 1
+            parse_group(tree)
+            if pos >= len(tokens) or tokens[pos] != "}":
+                raise ValueError(f"Invalid select expression '{text}': missing '}}'")
+            pos += 1
+            return
+        if pos >= len(tokens) or tokens[pos] in (".", ",", "}") or not re.match(r"^[^.,{}\[\]\s]+$", tokens[pos]):
+            raise ValueError(f"Invalid select expression '{text}': expected a field name at '{tokens[pos] if pos < len(tokens) else 'end'}'")
+        name = tokens[pos]
+        pos += 1
+        while pos < len(tokens) and tokens[pos] in ("[]", "[*]"):
+            pos += 1
+        if pos < len(tokens) and tokens[pos] == ".":
+            pos += 1
+            if name in tree and tree[name] is None:
+                parse_path({})  # the whole field is already selected
+            else:
+                parse_path(tree.setdefault(name, {}))
+        else:
+            tree[name] = None
 
-def attribute2json(body, attr) -> dict:
-    if attr in ['this', 'objectType']: # ignore these attributes
-        return None
-    try:
-        return getattr(body, attr)
-    except Exception:
+    tree = {}
+    parse_group(tree)
+    if pos != len(tokens):
+        raise ValueError(f"Invalid select expression '{text}': unexpected '{tokens[pos]}'")
+    return tree
+
+def select_child(select:dict|None, key) -> dict|None|bool:
+    """Returns the projection below key, None to keep everything, or False if key is not selected."""
+    if select is None:
         return None
+    elif key in select:
+        return select[key]
+    elif "*" in select:
+        return select["*"]
+    return False
+
+def project(value, select:dict|None) -> any:
+    """Applies a parse_select() tree to a JSON-compatible value; lists and iterators are projected element-wise."""
+    if select is None:
+        return value
+    elif isinstance(value, dict):
+        result = {}
+        for k, v in value.items():
+            child = select_child(select, k)
+            if child is not False:
+                result[k] = project(v, child)
+            elif k in ("$id", "$ref"):
+                result[k] = v
+        return result
+    elif isinstance(value, (list, tuple)):
+        return [project(x, select) for x in value]
+    elif isinstance(value, collections.abc.Iterator):
+        return map(lambda x: project(x, select), value)
+    return value
+
+def object_type_url(type_name:str) -> str:
+    return f"https://help.autodesk.com/view/fusion360/ENU/?cg=Developer%27s%20Documentation&query={type_name}%20Object"
+
+class TypePlan:
+    """Cached per-type serialization plan: how instances are walked and which attributes are read.
+    Only methods are dropped from the plan; attributes that raise are skipped per conversion by Object2Json,
+    since they may work on another document."""
+    def __init__(self, obj):
+        if hasattr(obj, 'asArray') and callable(obj.asArray):
+            self.kind = "array"
+        elif hasattr(obj, 'asDict') and callable(obj.asDict):
+            self.kind = "dict"
+        elif hasattr(obj, '__iter__') and callable(obj.__iter__):
+            self.kind = "iter"
+        else:
+            self.kind = "attrs"
+        self.builtin = isinstance(type(obj), type) and type(obj).__module__ == 'builtins'
+        self.object_type = object_type_url(type(obj).__name__)
+        self.attributes = [k for k in sorted(dir(obj), key=sort_attrs) if not k.startswith('_') and k not in ['this', 'objectType']] if self.kind == "attrs" else []
+        self.has_entity_token = "entityToken" in self.attributes
+
+    def skip(self, attr:str):
+        if attr in self.attributes:
+            self.attributes.remove(attr)
+type_plans = {}
+
+class Object2Json:
+    """Converts Fusion objects to JSON-compatible values. Objects already emitted in the same conversion
+    (same entityToken, or same Python object) are replaced by {"$ref": n} pointing at the first copy,
+    which is tagged with "$id": n. With a select projection, attributes not asked for are never read."""
+    def __init__(self, max_depth:int):
+        self.max_depth = max_depth
+        self.seen = {}
+        self.ids = 0
+        self.nodes = 0
+        self.references = 0
+        self.failures = collections.Counter()  # (plan, attribute) -> instances it raised on in this conversion
+        self.succeeded = set()
+
+    def identity(self, obj, plan:TypePlan):
+        if plan.has_entity_token:
+            try:
+                return (type(obj).__name__, obj.entityToken)
+            except Exception:
+                pass
+        return id(obj)
+
+    def convert(self, obj, depth=0, select=None):
+        self.nodes += 1
+        if type(obj).__name__ in ['method', 'function', 'NoneType']:
+            return None
+        elif isinstance(obj, (int, float, str, bool)):
+            return obj
+        elif isinstance(obj, (list, tuple)):
+            return [self.convert(x, depth+1, select) for x in obj] if depth < self.max_depth else []
+        elif isinstance(obj, dict):
+            return self.convert_items(obj.items(), depth, select) if depth < self.max_depth else {}
+
+        plan = type_plans.get(type(obj))
+        if plan is None:
+            plan = type_plans[type(obj)] = TypePlan(obj)
+
+        key = None
+        if not plan.builtin and depth < self.max_depth:
+            key = self.identity(obj, plan) if select is None else (self.identity(obj, plan), id(select))
+            first = self.seen.get(key)
+            if first is not None and first[1] <= depth:
+                # already emitted at least as deep, also breaks reference cycles
+                self.references += 1
+                result = first[2]
+                if "$id" not in result:
+                    self.ids += 1
+                    result["$id"] = self.ids
+                if select is not None and select_child(select, 'objectType') is False:
+                    return {"$ref": result["$id"]}
+                return {"$ref": result["$id"], "objectType": plan.object_type}
+
+        if plan.kind == "array":
+            result = [self.convert(v, depth+1, select) for v in obj.asArray()] if depth < self.max_depth else []
+        elif plan.kind == "dict":
+            result = self.convert_items(obj.asDict().items(), depth, select) if depth < self.max_depth else {}
+        elif plan.kind == "iter":
+            result = self.convert_items(obj, depth, select) if depth < self.max_depth else {}
+        else:
+            result = {}
+            if key is not None:
+                self.seen[key] = (obj, depth, result)  # register before walking so cycles resolve to references
+            if depth < self.max_depth:
+                for k in list(plan.attributes):
+                    child = select_child(select, k)
+                    if child is False or self.failures[(plan, k)] >= PLAN_FAILURE_THRESHOLD:
+                        continue  # raised for several instances and never succeeded, e.g. unsupported in this document
+                    try:
+                        value = getattr(obj, k)
+                    except Exception:
+                        if (plan, k) not in self.succeeded:
+                            self.failures[(plan, k)] += 1
+                        continue
+                    self.succeeded.add((plan, k))
+                    if type(value).__name__ in ['method', 'function']:
+                        plan.skip(k)
+                        continue
+                    value = self.convert(value, depth+1, child)
+                    if value is not None:
+                        result[k] = value
+
+        # Check if the object's type is a built-in type
+        if plan.builtin:
+            pass
+        elif isinstance(result, (list, tuple)):
+            result = {
+                'items': [x for x in result if x is not None],
+                'objectType': plan.object_type,
+            }
+        elif isinstance(result, dict):
+            for k in [k for k, v in result.items() if v is None]:
+                del result[k]
+            result['objectType'] = plan.object_type
+
+        if select is not None and isinstance(result, dict) and select_child(select, 'objectType') is False:
+            del result['objectType']
+
+        if key is not None and key not in self.seen:
+            self.seen[key] = (obj, depth, result)
+        return result
+
+    def convert_items(self, items, depth, select):
+        result = {}
+        for k, v in items:
+            child = select_child(select, k)
+            if child is not False:
+                result[k] = self.convert(v, depth+1, child)
+        return result
+
+object2json_stats = { "calls": 0, "nodes": 0, "references": 0, "seconds": 0.0, "last": None }
+def object2json(obj, max_depth, depth=0, select=None):
+    start = time.perf_counter()
+    converter = Object2Json(max_depth)
+    result = converter.convert(obj, depth, select)
+
+    last = {
+        "nodes": converter.nodes,
+        "references": converter.references,
+        "seconds": round(time.perf_counter() - start, 6),
+    }
+    object2json_stats["calls"] += 1
+    object2json_stats["nodes"] += last["nodes"]
+    object2json_stats["references"] += last["references"]
+    object2json_stats["seconds"] += last["seconds"]
+    object2json_stats["last"] = last
+    object2json_stats["types"] = len(type_plans)
+    return result
 
-customEventArguments = {}
 class CustomEventArgument:
-    def __init__(self, path, query, context):
+    def __init__(self, path, query, context, func=None):
         self.uuid = str(uuid.uuid4())
         self.event = threading.Event()
         self.path = path
         self.query = query
         self.context = context
+        self.func = func
+        self.select = None
+        self.deadline = None  # time.monotonic() after which the request is dropped instead of run
+        self.on_done = None  # optional callback, e.g. to resolve an asyncio future from the UI thread
         self.result = None
         self.http_error = None
+        self.priority = "normal"  # lane in the work queue, one of PRIORITIES
+        self.profile = None  # None, "stats" or "dump", see Profiles
+        self.profile_top = PROFILE_TOP
+        self.cache_key = None  # set on the UI thread for routes registered with cache=True
+        self.cache_revision = None
+        self.cached = None  # (body, etag) of a result cache hit, sent by send_result without running the route
+        self.queued = None  # time.monotonic() stamps for queue wait and handler time
+        self.started = None
+        self.finished = None
+        self.abandoned = False  # answered with 504, the result is discarded once it arrives
+        self.cancelled = False  # removed from the work queue by /jobs before it ran
+        self.http_thread = False  # runs and is sent apart from UI-thread requests, see routes.register(..., http_thread=)
+
+    def done(self):
+        """Signals completion to the waiting HTTP thread or coroutine."""
+        self.event.set()
+        if self.on_done:
+            self.on_done()
 
     def __str__(self):
         return f"CustomEventArgument(uuid={self.uuid})"
@@ -103,148 +439,2267 @@ class CustomEventArgument:
     def __repr__(self):
         return self.__str__()
 
-def handle_restart(path:str, app) -> any:
-    modules = {x: getattr(sys.modules.get(x), '__file__', None) for x in sorted(sys.modules)}
-    my_modules = {k: v for k, v in modules.items() if v is not None and "FusionHeadless" in v}
+class WorkQueue:
+    """Thread-safe FIFOs of pending requests, one per priority lane. A burst of requests is drained by a single
+    custom event, interactive requests first."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lanes = {priority: collections.deque() for priority in PRIORITIES}
+        self.event_pending = False
+        self.events_fired = 0
+        self.drains = 0
+        self.drained = 0
+        self.max_depth = 0
+        self.rejected = 0
+        self.expired = 0
+        self.timed_out = 0
+        self.bypassed = 0
+        self.yielded = 0
+
+    def depth(self) -> int:
+        return sum(len(lane) for lane in self.lanes.values())
+
+    def put(self, arg:CustomEventArgument, limit:int|None=None) -> bool:
+        """Queues arg, returns False without queueing if limit requests are already waiting in its lane,
+        so a backlog of bulk work never locks out interactive requests."""
+        with self.lock:
+            if limit is not None and len(self.lanes[arg.priority]) >= limit:
+                self.rejected += 1
+                return False
+            arg.queued = time.monotonic()
+            self.lanes[arg.priority].append(arg)
+            self.max_depth = max(self.max_depth, self.depth())
+            if self.event_pending:
+                return True  # the pending event will pick this one up
+            self.event_pending = True
+            self.events_fired += 1
+        app.fireCustomEvent('FusionHeadless.ExecOnUiThread')
+        return True
+
+    def bypass(self, arg:CustomEventArgument):
+        """Records a request that runs on an HTTP thread instead of waiting in the queue."""
+        with self.lock:
+            arg.queued = time.monotonic()
+            self.bypassed += 1
+
+    def next_lane(self, priorities:tuple) -> collections.deque|None:
+        """The first lane with work, unless a later lane's oldest request has waited longer than PRIORITY_AGING."""
+        now = time.monotonic()
+        for priority in priorities:
+            lane = self.lanes[priority]
+            if lane and now - lane[0].queued > PRIORITY_AGING:
+                return lane
+        return next((self.lanes[priority] for priority in priorities if self.lanes[priority]), None)
+
+    def cancel(self, arg:CustomEventArgument) -> bool:
+        """Removes a request that has not started yet, returns False if it is running or finished."""
+        with self.lock:
+            try:
+                self.lanes[arg.priority].remove(arg)
+            except ValueError:
+                return False
+            arg.cancelled = True
+        return True
+
+    def get(self, priorities:tuple=PRIORITIES) -> CustomEventArgument|None:
+        """Returns the next request to run from the given lanes; requests past their deadline are answered with 504 and skipped."""
+        with self.lock:
+            while (lane := self.next_lane(priorities)) is not None:
+                arg = lane.popleft()
+                if arg.deadline is not None and time.monotonic() > arg.deadline:
+                    self.expired += 1
+                    arg.http_error = (504, "Deadline expired while waiting for Fusion's UI thread.")
+                    arg.done()
+                    continue
+                self.drained += 1
+                return arg
+            return None
+
+    def finish_drain(self) -> bool:
+        """Called at the end of a drain, returns True if work remains and the event must be fired again."""
+        with self.lock:
+            self.drains += 1
+            if self.depth():
+                self.events_fired += 1
+                return True
+            self.event_pending = False
+            return False
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "depth": self.depth(),
+                "lanes": {priority: len(lane) for priority, lane in self.lanes.items()},
+                "max_depth": self.max_depth,
+                "event_pending": self.event_pending,
+                "events_fired": self.events_fired,
+                "drains": self.drains,
+                "drained": self.drained,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "timed_out": self.timed_out,
+                "bypassed": self.bypassed,
+                "yielded": self.yielded,
+                "max_queue_depth": MAX_QUEUE_DEPTH,
+            }
+work_queue = WorkQueue()
+
+class ScriptRegistry:
+    """Script sources addressed by their SHA-256, plus an LRU of compiled code shared by /eval and /exec."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sources = collections.OrderedDict()
+        self.compiled = collections.OrderedDict()
+        self.uploads = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def hash(code:str) -> str:
+        return hashlib.sha256(code.encode()).hexdigest()
+
+    def add(self, code:str) -> str:
+        """Stores code and returns its hash; the least recently used source is dropped beyond MAX_SCRIPTS."""
+        key = self.hash(code)
+        with self.lock:
+            self.uploads += 1
+            self.sources[key] = code
+            self.sources.move_to_end(key)
+            while len(self.sources) > MAX_SCRIPTS:
+                self.sources.popitem(last=False)
+        return key
+
+    def source(self, key:str) -> str|None:
+        with self.lock:
+            code = self.sources.get(key)
+            if code is not None:
+                self.sources.move_to_end(key)
+            return code
+
+    def compile(self, code:str, mode:str, key:str|None=None) -> types.CodeType:
+        """Returns the compiled code for mode "eval" or "exec", compiling only on a cache miss."""
+        key = (key or self.hash(code), mode)
+        with self.lock:
+            compiled = self.compiled.get(key)
+            if compiled is not None:
+                self.hits += 1
+                self.compiled.move_to_end(key)
+                return compiled
+            self.misses += 1
+        compiled = compile(code, "<string>", mode)  # "<string>" lets the cli map tracebacks back to the uploaded file
+        with self.lock:
+            self.compiled[key] = compiled
+            while len(self.compiled) > MAX_COMPILED_SCRIPTS:
+                self.compiled.popitem(last=False)
+        return compiled
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "scripts": len(self.sources),
+                "compiled": len(self.compiled),
+                "uploads": self.uploads,
+                "hits": self.hits,
+                "misses": self.misses,
+                "max_scripts": MAX_SCRIPTS,
+                "max_compiled": MAX_COMPILED_SCRIPTS,
+            }
+script_registry = ScriptRegistry()
+
+class SessionStore:
+    """Named globals dicts that persist across /eval and /exec calls, closed when idle or over MAX_SESSIONS."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = collections.OrderedDict()  # id -> [namespace, created, last_used, calls]
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        self.closed = 0
+
+    def expire(self) -> None:
+        now = time.monotonic()
+        with self.lock:
+            while self.sessions:
+                key, session = next(iter(self.sessions.items()))
+                if now - session[2] <= SESSION_TTL:
+                    break
+                del self.sessions[key]
+                self.expired += 1
+
+    def namespace(self, key:str, context:dict) -> dict:
+        """Returns the namespace of session key, created on first use, refreshed with this request's context."""
+        self.expire()
+        now = time.monotonic()
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = self.sessions[key] = [{}, now, now, 0]
+                self.created += 1
+                while len(self.sessions) > MAX_SESSIONS:
+                    self.sessions.popitem(last=False)
+                    self.evicted += 1
+            self.sessions.move_to_end(key)
+            session[2] = now
+            session[3] += 1
+        namespace = session[0]
+        namespace.update(context)
+        namespace.pop("result", None)  # a result left over from the previous call must not be returned again
+        return namespace
+
+    def close(self, key:str) -> bool:
+        with self.lock:
+            if self.sessions.pop(key, None) is None:
+                return False
+            self.closed += 1
+            return True
+
+    def list(self) -> dict:
+        self.expire()
+        now = time.monotonic()
+        with self.lock:
+            return {key: {"age": round(now - created, 3), "idle": round(now - last_used, 3), "calls": calls, "names": len(namespace)}
+                    for key, (namespace, created, last_used, calls) in self.sessions.items()}
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "active": len(self.sessions),
+                "created": self.created,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "closed": self.closed,
+                "max_sessions": MAX_SESSIONS,
+                "ttl": SESSION_TTL,
+            }
+sessions = SessionStore()
+
+def route_options(path:str) -> dict:
+    """The options of a built-in path from BUILTIN_ROUTES, or those a route was registered with."""
+    return BUILTIN_ROUTES[path] if path in BUILTIN_ROUTES else routes.get_options(path)
+
+def route_flag(path:str, name:str, query:dict) -> bool:
+    """Evaluates a boolean route option such as etag or cache, which may be True or a predicate of the query."""
+    option = route_options(path).get(name)
+    if callable(option):
+        return bool(option(query))
+    return bool(option)
+
+def document_key(document) -> str|None:
+    if document is None:
+        return None
+    data_file = document.dataFile
+    return data_file.id if data_file else f"unsaved:{document.name}"
+
+class ResultCache:
+    """Encoded JSON responses of routes registered with cache=True, keyed by document, route and normalized query.
+    Fusion's document and command events, and any request that may modify the design, drop the entries, so polling an
+    unchanged design is answered from the HTTP thread without queueing for the UI thread."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()  # key -> (body, etag)
+        self.size = 0
+        self.revision = 0  # bumped by every invalidation, results computed before it are not stored
+        self.active_document = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(document:str, path:str, query:dict, select:dict|None) -> tuple:
+        return (document, path, json.dumps([query, select], sort_keys=True, default=str))
+
+    def get(self, path:str, query:dict, select:dict|None) -> tuple|None:
+        with self.lock:
+            if self.active_document is None:
+                return None  # unknown until the UI thread has run a cached route or reported an activation
+            key = self.key(self.active_document, path, query, select)
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+
+    def prepare(self, arg:CustomEventArgument):
+        """Called on the UI thread before a cached route runs, records the key its result will be stored under."""
+        document = document_key(app.activeDocument)
+        with self.lock:
+            self.active_document = document
+            arg.cache_key = self.key(document, arg.path, arg.query, arg.select)
+            arg.cache_revision = self.revision
+
+    def put(self, arg:CustomEventArgument, body:bytes, etag:str):
+        if len(body) > CACHE_MAX_BYTES // 4:
+            return
+        with self.lock:
+            if arg.cache_revision != self.revision:
+                return  # the design changed while the result was being sent
+            old = self.entries.pop(arg.cache_key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self.entries[arg.cache_key] = (body, etag)
+            self.size += len(body)
+            while self.size > CACHE_MAX_BYTES:
+                _, (dropped, _) = self.entries.popitem(last=False)
+                self.size -= len(dropped)
+                self.evictions += 1
+
+    def invalidate(self, document:str|None=None):
+        """Drops the entries of document, or all entries if it is None."""
+        with self.lock:
+            self.revision += 1
+            self.invalidations += 1
+            for key in [key for key in self.entries if document is None or key[0] == document]:
+                self.size -= len(self.entries.pop(key)[0])
+
+    def activate(self, document:str|None):
+        with self.lock:
+            self.active_document = document
 
-    result = {}
-    for module in my_modules:
-        if module == "server":
-            continue
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": CACHE_MAX_BYTES,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+            }
+result_cache = ResultCache()
 
+def may_modify(arg:CustomEventArgument) -> bool:
+    """Conservatively True for any request that is not known to be read-only, e.g. /exec or setting parameters."""
+    if arg.func is not None or route_flag(arg.path, "http_thread", arg.query):
+        return False
+    return not (route_flag(arg.path, "cache", arg.query) or route_flag(arg.path, "etag", arg.query))
+
+class EventSubscriber:
+    """One /events client: its filter and a bounded buffer of events it has not been sent yet."""
+    def __init__(self, types:set|None, document:str|None, wake):
+        self.types = types
+        self.document = document
+        self.wake = wake  # called from any thread when events were buffered or the bus closed
+        self.events = collections.deque(maxlen=EVENT_BUFFER_SIZE)
+        self.dropped = 0  # events lost since the client was last sent a resync
+        self.closed = False
+
+    def matches(self, event:dict) -> bool:
+        return (self.types is None or event["type"] in self.types) and (self.document is None or event["document"] == self.document)
+
+    def buffer(self, event:dict):
+        if len(self.events) == self.events.maxlen:
+            self.dropped += 1
+        self.events.append(event)
+
+class EventBus:
+    """Fans Fusion's document and command events out to /events clients. Every event carries the document's
+    revision, bumped by anything but an activation, so clients re-query a document only when it changed."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.history = collections.deque(maxlen=EVENT_HISTORY)
+        self.sequence = 0
+        self.revisions = {}  # document -> revision
+        self.published = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def publish(self, type:str, document:str|None, **data):
+        with self.lock:
+            self.sequence += 1
+            if type != "activated":
+                self.revisions[document] = self.revisions.get(document, 0) + 1
+            event = {"id": self.sequence, "type": type, "document": document, "revision": self.revisions.get(document, 0), "time": time.time()}
+            event.update(data)
+            self.history.append(event)
+            self.published += 1
+            woken = []
+            for subscriber in self.subscribers:
+                if subscriber.matches(event):
+                    subscriber.buffer(event)
+                    woken.append(subscriber)
+        for subscriber in woken:
+            subscriber.wake()
+
+    def subscribe(self, types:set|None, document:str|None, wake, last_id:int|None=None) -> EventSubscriber|None:
+        """Returns a new subscriber, or None beyond MAX_EVENT_CLIENTS. Events after last_id are replayed if
+        they are still in the history, otherwise the subscriber starts with a resync."""
+        subscriber = EventSubscriber(types, document, wake)
+        with self.lock:
+            if len(self.subscribers) >= MAX_EVENT_CLIENTS:
+                self.rejected += 1
+                return None
+            if last_id is not None:
+                oldest = self.history[0]["id"] if self.history else self.sequence + 1
+                if last_id > self.sequence or last_id < oldest - 1:
+                    subscriber.dropped = 1  # from a previous server run, or older than the history
+                for event in self.history:
+                    if event["id"] > last_id and subscriber.matches(event):
+                        subscriber.buffer(event)
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber:EventSubscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def take(self, subscriber:EventSubscriber) -> tuple[list, int]:
+        """Returns and clears the subscriber's buffered events and the number dropped before them."""
+        with self.lock:
+            events, dropped = list(subscriber.events), subscriber.dropped
+            subscriber.events.clear()
+            subscriber.dropped = 0
+            self.dropped += dropped
+        return events, dropped
+
+    def close(self):
+        """Ends all streams, e.g. when the server stops."""
+        with self.lock:
+            subscribers = list(self.subscribers)
+            for subscriber in subscribers:
+                subscriber.closed = True
+        for subscriber in subscribers:
+            subscriber.wake()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "clients": len(self.subscribers),
+                "max_clients": MAX_EVENT_CLIENTS,
+                "published": self.published,
+                "dropped": self.dropped,
+                "rejected": self.rejected,
+                "last_id": self.sequence,
+            }
+event_bus = EventBus()
+
+def publish_change(type:str, **data):
+    """Publishes an event for the active document. Runs on the UI thread."""
+    try:
+        document = (app or adsk.core.Application.get()).activeDocument
+        event_bus.publish(type, document_key(document), name=document.name if document else None, **data)
+    except Exception:
+        event_bus.publish(type, None, **data)
+
+class DocumentChangedHandler(adsk.core.DocumentEventHandler):
+    """documentOpened/documentActivated/documentSaved/documentClosed: drops cached results of the document and
+    publishes the event to /events clients."""
+    def __init__(self, event:str):
+        super().__init__()
+        self.event = event
+
+    def notify(self, args):
         try:
-            importlib.reload(sys.modules[module])
-            result[module] = "Reloaded"
+            document = document_key(args.document)
+            name = args.document.name if args.document else None
         except Exception:
-            del sys.modules[module]
-            result[module] = "Removed"
+            result_cache.invalidate()
+            event_bus.publish(self.event, None)
+            return
+        result_cache.invalidate(document)
+        if self.event == "activated":
+            result_cache.activate(document)
+        event_bus.publish(self.event, document, name=name)
+
+class CommandTerminatedHandler(adsk.core.ApplicationCommandEventHandler):
+    """commandTerminated: a completed command other than selection and viewing may have modified the active design."""
+    def __init__(self):
+        super().__init__()
+
+    def notify(self, args):
+        if args.commandId in NON_MODIFYING_COMMANDS:
+            return
+        if args.terminationReason == adsk.core.CommandTerminationReason.CompletedTerminationReason:
+            result_cache.invalidate(result_cache.active_document)
+            publish_change("command", command=args.commandId)
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(METRICS_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value:float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(METRICS_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+                break
+
+    def lines(self, name:str, labels:str) -> list[str]:
+        lines, cumulative = [], 0
+        for bound, count in zip(METRICS_BUCKETS, self.buckets):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+class Metrics:
+    """Per-route request counters and phase histograms, rendered in the Prometheus text format by /metrics."""
+    PHASES = ("queue_wait", "handler", "serialize", "send")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = collections.Counter()  # (route, code) -> count
+        self.bytes_sent = collections.Counter()  # route -> bytes
+        self.histograms = {}  # (phase, route) -> Histogram
+        self.in_flight = 0
+        self.scrapes = 0
+
+    @staticmethod
+    def route(path:str) -> str:
+        """Unknown paths share one label so probing clients cannot grow the series without bound."""
+        if path in routes.routes or path in BUILTIN_ROUTES:
+            return path
+        return "other"
+
+    def begin(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def end(self, path:str, code:int|None, sent_bytes:int, phases:dict):
+        route = self.route(path)
+        with self.lock:
+            self.in_flight -= 1
+            self.requests[(route, code or 0)] += 1
+            self.bytes_sent[route] += sent_bytes
+            for phase, seconds in phases.items():
+                if seconds is not None:
+                    histogram = self.histograms.get((phase, route))
+                    if histogram is None:
+                        histogram = self.histograms[(phase, route)] = Histogram()
+                    histogram.observe(max(0.0, seconds))
+
+    def render(self) -> str:
+        with self.lock:
+            self.scrapes += 1
+            lines = [
+                "# HELP fusionheadless_requests_total Requests answered, by route and status code.",
+                "# TYPE fusionheadless_requests_total counter",
+            ]
+            lines += [f'fusionheadless_requests_total{{route="{route}",code="{code}"}} {count}' for (route, code), count in sorted(self.requests.items())]
+            lines += [
+                "# HELP fusionheadless_errors_total Requests answered with a 4xx or 5xx status.",
+                "# TYPE fusionheadless_errors_total counter",
+            ]
+            lines += [f'fusionheadless_errors_total{{route="{route}",code="{code}"}} {count}' for (route, code), count in sorted(self.requests.items()) if code >= 400]
+            lines += [
+                "# HELP fusionheadless_response_bytes_total Bytes written to clients, headers included.",
+                "# TYPE fusionheadless_response_bytes_total counter",
+            ]
+            lines += [f'fusionheadless_response_bytes_total{{route="{route}"}} {count}' for route, count in sorted(self.bytes_sent.items())]
+            for phase in self.PHASES:
+                name = f"fusionheadless_{phase}_seconds"
+                lines += [
+                    f"# HELP {name} Time spent in the {phase.replace('_', ' ')} phase of a request.",
+                    f"# TYPE {name} histogram",
+                ]
+                for (p, route), histogram in sorted(self.histograms.items()):
+                    if p == phase:
+                        lines += histogram.lines(name, f'route="{route}"')
+            lines += [
+                "# HELP fusionheadless_in_flight Requests received but not yet answered.",
+                "# TYPE fusionheadless_in_flight gauge",
+                f"fusionheadless_in_flight {self.in_flight}",
+                "# HELP fusionheadless_queue_depth Requests waiting for Fusion's UI thread.",
+                "# TYPE fusionheadless_queue_depth gauge",
+                f"fusionheadless_queue_depth {work_queue.depth()}",
+                "# HELP fusionheadless_metrics_scrapes_total Requests to /metrics, not included in the route metrics.",
+                "# TYPE fusionheadless_metrics_scrapes_total counter",
+                f"fusionheadless_metrics_scrapes_total {self.scrapes}",
+            ]
+        return "\n".join(lines) + "\n"
+metrics = Metrics()
+
+class Profiles:
+    """cProfile summaries of requests sent with ?profile=1 (or profile=dump to also write a pstats file), by request id."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = threading.Lock()  # held while a request is profiled, only one profiler can run at a time
+        self.profiles = collections.OrderedDict()
+
+    def run(self, arg:CustomEventArgument, func) -> None:
+        """Runs func(arg) under cProfile. A request profiled while another one is (e.g. run through yield_ui,
+        or an http_thread route overlapping a UI-thread one) runs unprofiled and its profile says why."""
+        if not self.active.acquire(blocking=False):
+            self.store(arg, {"id": arg.uuid, "path": arg.path, "skipped": "Another request is being profiled."})
+            return func(arg)
+        try:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError as e:  # another profiling tool is active, e.g. a debugger
+                self.store(arg, {"id": arg.uuid, "path": arg.path, "skipped": str(e)})
+                return func(arg)
+            try:
+                func(arg)
+            finally:
+                profiler.disable()
+                self.add(arg, profiler)
+        finally:
+            self.active.release()
+
+    def add(self, arg:CustomEventArgument, profiler:cProfile.Profile) -> dict:
+        try:
+            stats = pstats.Stats(profiler).sort_stats("cumulative")
+        except TypeError:  # nothing was recorded
+            return self.store(arg, {"id": arg.uuid, "path": arg.path, "skipped": "No profile data was recorded."})
+        summary = {
+            "id": arg.uuid,
+            "path": arg.path,
+            "total_time": round(stats.total_tt, 6),
+            "total_calls": stats.total_calls,
+            "top": [{
+                    "function": pstats.func_std_string(func),
+                    "calls": calls,
+                    "primitive_calls": primitive_calls,
+                    "tottime": round(tottime, 6),
+                    "cumtime": round(cumtime, 6),
+                } for func in stats.fcn_list[:arg.profile_top]
+                for primitive_calls, calls, tottime, cumtime, _ in [stats.stats[func]]],
+        }
+        if arg.profile == "dump":
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            summary["dump"] = os.path.join(PROFILE_DIR, f"{arg.uuid}.pstats")
+            stats.dump_stats(summary["dump"])
+        return self.store(arg, summary)
+
+    def store(self, arg:CustomEventArgument, summary:dict) -> dict:
+        with self.lock:
+            self.profiles[arg.uuid] = summary
+            while len(self.profiles) > MAX_PROFILES:
+                _, dropped = self.profiles.popitem(last=False)
+                if "dump" in dropped and os.path.exists(dropped["dump"]):
+                    os.remove(dropped["dump"])
+        return summary
+
+    def get(self, key:str) -> dict|None:
+        with self.lock:
+            return self.profiles.get(key)
+
+    def list(self) -> list[dict]:
+        with self.lock:
+            return [{"id": key, "path": summary["path"], "total_time": summary.get("total_time")} for key, summary in self.profiles.items()]
+profiles = Profiles()
+
+class ArtifactStore:
+    """Files of routes registered with artifacts=True, e.g. exports, kept under a random id for ARTIFACT_TTL seconds
+    so an interrupted download resumes with a Range request on /artifacts instead of running the export again."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.artifacts = collections.OrderedDict()  # id -> SimpleNamespace(id, path, size, content_type, expires)
+        self.size = 0
+        self.stale = []  # files that could not be removed yet, e.g. still being sent on Windows
+        self.expired = 0
+        shutil.rmtree(ARTIFACT_DIR, ignore_errors=True)  # unreachable leftovers of a previous run
+
+    def add(self, response) -> types.SimpleNamespace:
+        """Takes over the file of a FileResponse; temporary files are moved, others copied."""
+        key = uuid.uuid4().hex
+        os.makedirs(ARTIFACT_DIR, exist_ok=True)
+        path = os.path.join(ARTIFACT_DIR, key + os.path.splitext(response.path)[1])
+        if response.delete:
+            shutil.move(response.path, path)
+        else:
+            shutil.copyfile(response.path, path)
+        artifact = types.SimpleNamespace(id=key, path=path, size=os.path.getsize(path),
+                                         content_type=response.headers.get("Content-Type", "application/octet-stream"),
+                                         expires=time.time() + ARTIFACT_TTL)
+        with self.lock:
+            self.artifacts[key] = artifact
+            self.size += artifact.size
+        self.expire()
+        return artifact
+
+    def get(self, key:str) -> types.SimpleNamespace|None:
+        self.expire()
+        with self.lock:
+            return self.artifacts.get(key)
+
+    def expire(self):
+        now = time.time()
+        with self.lock:
+            while self.artifacts:
+                artifact = next(iter(self.artifacts.values()))
+                if artifact.expires > now and len(self.artifacts) <= MAX_ARTIFACTS and self.size <= ARTIFACT_MAX_BYTES:
+                    break
+                del self.artifacts[artifact.id]
+                self.size -= artifact.size
+                self.stale.append(artifact.path)
+                self.expired += 1
+            stale, self.stale = self.stale, []
+        for path in stale:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                with self.lock:
+                    self.stale.append(path)
+
+    def clear(self):
+        with self.lock:
+            self.stale += [artifact.path for artifact in self.artifacts.values()]
+            self.artifacts.clear()
+            self.size = 0
+        self.expire()
+
+    def list(self) -> list[dict]:
+        self.expire()
+        with self.lock:
+            return [{"id": x.id, "size": x.size, "content_type": x.content_type, "expires": datetime.fromtimestamp(x.expires).isoformat()}
+                    for x in self.artifacts.values()]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"artifacts": len(self.artifacts), "bytes": self.size, "max_bytes": ARTIFACT_MAX_BYTES, "expired": self.expired}
+artifacts = ArtifactStore()
+
+class Job:
+    """A request submitted to /jobs, answered right away with the job's id. Injected into handlers as job, so long
+    ones can report progress and stop early once cancelled is set."""
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.arg = None
+        self.created = datetime.now()
+        self.cancelled = False
+        self.fraction = None
+        self.message = None
+        self.expires = None  # time.time() after which a finished job is dropped
+        self.artifact = None  # FileResponse results are moved to the artifact store when first fetched
+
+    def progress(self, fraction:float|None=None, message:str|None=None):
+        """Reports progress from the handler, fraction between 0 and 1."""
+        self.fraction = fraction
+        self.message = message
+
+    @property
+    def state(self) -> str:
+        if self.arg.cancelled:
+            return "cancelled"
+        if self.arg.started is None:
+            return "queued"
+        if not self.arg.event.is_set():
+            return "cancelling" if self.cancelled else "running"
+        if self.cancelled:
+            return "cancelled"  # stopped by the handler, or finished although asked to stop
+        return "failed" if self.arg.http_error else "done"
+
+    def describe(self) -> dict:
+        now = time.monotonic()
+        arg = self.arg
+        result = {
+            "id": self.id,
+            "path": arg.path,
+            "state": self.state,
+            "priority": arg.priority,
+            "created": self.created.isoformat(),
+            "progress": self.fraction,
+            "message": self.message,
+            "waited": round((arg.started or now) - arg.queued, 3) if arg.queued else None,
+            "ran": round((arg.finished or now) - arg.started, 3) if arg.started else None,
+        }
+        if arg.http_error and not arg.cancelled and not self.cancelled:
+            result["error"] = {"code": arg.http_error[0], "message": arg.http_error[1]}
+        return result
+
+class JobTable:
+    """Jobs by id, at most MAX_JOBS; finished ones are dropped JOB_TTL seconds after they finished."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = collections.OrderedDict()  # id -> Job
+        self.submitted = 0
+        self.cancelled = 0
+        self.expired = 0
+        self.rejected = 0
+
+    def add(self, job:Job) -> bool:
+        self.expire()
+        with self.lock:
+            if len(self.jobs) >= MAX_JOBS:
+                self.rejected += 1
+                return False
+            self.jobs[job.id] = job
+            self.submitted += 1
+        return True
+
+    def finished(self, job:Job):
+        job.expires = time.time() + JOB_TTL
+
+    def get(self, key:str) -> Job|None:
+        self.expire()
+        with self.lock:
+            return self.jobs.get(key)
+
+    def cancel(self, job:Job):
+        """Cancels a queued job, asks a running one to stop, or drops a finished one and its result."""
+        if job.arg.event.is_set():
+            return self.remove(job)
+        with self.lock:
+            self.cancelled += 1
+        if work_queue.cancel(job.arg):
+            job.arg.http_error = (409, f"Job {job.id} was cancelled before it ran.")
+            job.arg.done()
+        else:
+            job.cancelled = True  # running, seen by handlers that check job.cancelled
+
+    def remove(self, job:Job):
+        with self.lock:
+            self.jobs.pop(job.id, None)
+        discard_result(job.arg)
+
+    def expire(self):
+        now = time.time()
+        with self.lock:
+            expired = [job for job in self.jobs.values() if job.expires is not None and job.expires < now]
+            self.expired += len(expired)
+        for job in expired:
+            self.remove(job)
+
+    def list(self) -> list[dict]:
+        self.expire()
+        with self.lock:
+            return [job.describe() for job in self.jobs.values()]
+
+    def stats(self) -> dict:
+        with self.lock:
+            states = collections.Counter(job.state for job in self.jobs.values())
+            return {
+                "jobs": len(self.jobs),
+                "max_jobs": MAX_JOBS,
+                "states": dict(states),
+                "submitted": self.submitted,
+                "cancelled": self.cancelled,
+                "expired": self.expired,
+                "rejected": self.rejected,
+            }
+jobs = JobTable()
+
+def parse_range(value:str|None, size:int) -> tuple[int, int]|None:
+    """Parses a Range header into an inclusive (first, last) byte range. None means the whole body, for no,
+    malformed or multiple ranges (which may be ignored); ValueError means the range is not satisfiable."""
+    match = re.fullmatch(r"\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*", value or "")
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    if match.group(1) == "":
+        first, last = max(0, size - int(match.group(2))), size - 1  # suffix: the last n bytes
+    else:
+        first = int(match.group(1))
+        last = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    if first > last or first >= size:
+        raise ValueError(value)
+    return first, last
+
+class ModuleReloader:
+    """Reloads only the add-in modules whose source changed, followed by the modules referring to them (e.g. routes,
+    which holds the handlers, or a route importing names from _utils_), dependencies first."""
+    def __init__(self):
+        self.since = time.time()
+        self.sources = {}  # sys.modules key -> (mtime_ns, size, sha256)
+        self.failed = set()  # modules left half-initialized by a failed reload, retried by the next one
+        for key, module in self.modules().items():
+            self.changed(key, module.__file__)
+
+    @staticmethod
+    def modules() -> dict:
+        """Add-in modules by sys.modules key, including FusionHeadless.<route> and FusionHeadless.mcp.<tool>. The
+        server is left out, it is only replaced by /restart."""
+        return {key: module for key, module in list(sys.modules.items())
+                if key != "server" and isinstance(getattr(module, "__file__", None), str)
+                and os.path.abspath(module.__file__).startswith(ADDIN_DIR)}
+
+    def changed(self, key:str, path:str) -> bool:
+        """Compares the file with the recorded state; a new mtime with identical content only updates the record."""
+        stat = os.stat(path)
+        known = self.sources.get(key)
+        if known is not None and known[:2] == (stat.st_mtime_ns, stat.st_size):
+            return False
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        self.sources[key] = (stat.st_mtime_ns, stat.st_size, digest)
+        if known is None:
+            return stat.st_mtime > self.since  # first seen (loaded lazily), edited since the server started
+        return known[2] != digest
+
+    @staticmethod
+    def references(module:types.ModuleType, keys:dict) -> set:
+        """Keys of the tracked modules that module's globals, or the values of its containers, refer to."""
+        found = set()
+        for name, value in list(vars(module).items()):
+            if name.startswith("__"):
+                continue
+            items = list(value.values())[:1000] if isinstance(value, dict) else list(value)[:1000] if isinstance(value, (list, tuple, set)) else [value]
+            for item in items:
+                owner = id(item) if isinstance(item, types.ModuleType) else getattr(item, "__module__", None)
+                key = keys.get(owner) if isinstance(owner, (int, str)) else None
+                if key is not None:
+                    found.add(key)
+        return found
+
+    @staticmethod
+    def reload_module(module:types.ModuleType):
+        """Re-executes module in place like importlib.reload, which cannot find the spec of modules loaded from a file
+        location (_utils_, FusionHeadless.<route>, FusionHeadless.mcp.<tool>)."""
+        if module.__spec__ is None or module.__spec__.loader is None:
+            return importlib.reload(module)
+        sys.path.insert(0, os.path.dirname(module.__file__))
+        try:
+            module.__spec__.loader.exec_module(module)
+        finally:
+            sys.path.pop(0)
+
+    def reload(self, everything:bool=False) -> dict:
+        start = time.perf_counter()
+        modules = self.modules()
+        result = {"reloaded": {}, "removed": {}, "failed": {}}
+        reasons = {}
+        for key, module in modules.items():
+            if not os.path.exists(module.__file__):
+                del sys.modules[key]
+                self.sources.pop(key, None)
+                result["removed"][key] = "Source file deleted"
+            elif self.changed(key, module.__file__) or everything:
+                reasons[key] = "changed"
+            elif key in self.failed:
+                reasons[key] = "failed before"
+        modules = {key: module for key, module in modules.items() if key in sys.modules}
+
+        keys = {}
+        for key, module in modules.items():
+            keys[id(module)] = key
+            keys.setdefault(module.__name__, key)
+        dependencies = {key: self.references(module, keys) - {key} for key, module in modules.items()}
+        pending = list(reasons)
+        while pending:
+            changed = pending.pop()
+            for key, uses in dependencies.items():
+                if changed in uses and key not in reasons:
+                    reasons[key] = f"depends on {changed}"
+                    pending.append(key)
+
+        order, visiting = [], set()
+        def visit(key):
+            if key in order or key in visiting:
+                return  # already placed, or an import cycle
+            visiting.add(key)
+            for dependency in sorted(dependencies[key]):
+                if dependency in reasons:
+                    visit(dependency)
+            order.append(key)
+        for key in sorted(reasons):
+            visit(key)
+
+        for key in order:
+            module_start = time.perf_counter()
+            try:
+                self.reload_module(modules[key])
+                self.failed.discard(key)
+                result["reloaded"][key] = {"reason": reasons[key], "seconds": round(time.perf_counter() - module_start, 6)}
+            except Exception:
+                error = traceback.format_exc().strip().splitlines()[-1]
+                if key.startswith("FusionHeadless."):
+                    del sys.modules[key]  # loaded lazily, imported again on next use
+                    self.sources.pop(key, None)
+                    result["removed"][key] = error
+                else:
+                    self.failed.add(key)
+                    result["failed"][key] = error
+        result["unchanged"] = len(modules) - len(order)
+        result["seconds"] = round(time.perf_counter() - start, 6)
+        return result
 
+module_reloader = ModuleReloader()
+
+def handle_restart(path:str, app) -> any:
+    result = module_reloader.reload(everything=path == "/restart")
     if path == "/restart":
         result["server"] = "Restarting.."
         app.fireCustomEvent('FusionHeadless.Restart')
     return result
 
-class ExecOnUiThreadHandler(adsk.core.CustomEventHandler):
-    def __init__(self):
-        super().__init__()
-    def notify(self, args):
-        global ui, customEventArguments
-        arg = None
+def is_http_response(obj) -> bool:
+    """HttpResponse subclasses are duck-typed since routes/_utils_ is loaded separately; generators also have send()."""
+    return callable(getattr(obj, 'send', None)) and hasattr(obj, 'headers') and not isinstance(obj, collections.abc.Generator)
+
+def materialize(obj) -> any:
+    """Pulls the iterators in a result (e.g. generators returned by handlers) into lists."""
+    if isinstance(obj, (collections.abc.Iterator, list, tuple)):
+        return [materialize(x) for x in obj]
+    if isinstance(obj, dict):
+        return {k: materialize(v) for k, v in obj.items()}
+    return obj
+
+def discard_result(arg:CustomEventArgument):
+    """Releases a result that will never be sent, e.g. deletes the temporary file of a FileResponse."""
+    discard = getattr(arg.result, "discard", None)
+    if callable(discard):
+        discard()
+
+def dispatch(arg:CustomEventArgument) -> None:
+    """Runs a single request on the UI thread, setting arg.result or arg.http_error."""
+    if arg.func is not None:
+        # internal work scheduled by the server itself, e.g. pulling the next items of a streamed result
+        arg.result = arg.func()
+    elif arg.path == "/eval" or arg.path == "/exec":
+        # evaluate or execute are low-level operations so a running server can be recovered
+        if "session" in arg.query:
+            arg.context = sessions.namespace(str(arg.query["session"]), arg.context)
+        if "script" in arg.query:
+            # a previously uploaded script runs first (typically defining functions), then the optional code
+            code = script_registry.source(arg.query["script"])
+            if code is None:
+                arg.http_error = (404, f"Unknown script {arg.query['script']}, upload it to /scripts first")
+                return
+            exec(script_registry.compile(code, "exec", arg.query["script"]), arg.context)
+        if arg.path == "/eval":
+            arg.result = eval(script_registry.compile(arg.query.get("code", ""), "eval"), arg.context)
+        elif arg.path == "/exec":
+            if "code" in arg.query:
+                exec(script_registry.compile(arg.query["code"], "exec"), arg.context)
+            arg.result = arg.context.get("result", None)
+
+        if "depth" in arg.query:
+            arg.result = object2json(arg.result, max_depth=int(arg.query["depth"]), select=arg.select)
+            arg.select = None  # already applied while walking, so unselected attributes were never read
+    elif arg.path == "/scripts":
+        if "code" not in arg.query:
+            arg.http_error = (400, "Missing 'code' to upload")
+            return
+        script_registry.compile(arg.query["code"], "exec")  # surfaces syntax errors at upload time, before storing
+        arg.result = {"script": script_registry.add(arg.query["code"])}
+    elif arg.path == "/sessions":
+        if "close" in arg.query:
+            arg.result = {"closed": sessions.close(str(arg.query["close"]))}
+        else:
+            arg.result = sessions.list()
+    elif arg.path == "/profiles":
+        if "id" in arg.query:
+            arg.result = profiles.get(arg.query["id"])
+            if arg.result is None:
+                arg.http_error = (404, f"No profile for request {arg.query['id']}")
+        else:
+            arg.result = profiles.list()
+    elif arg.path == "/restart" or arg.path == "/reload":
+        # restart and reload are low-level operations so a running server can be recovered
+        everything = arg.path == "/restart" or str(arg.query.get("all", "")).lower() in ("true", "1", "yes", "on")
+        arg.result = module_reloader.reload(everything)
+
+        if arg.path == "/restart":
+            arg.result["server"] = "Restarting.."
+            app.fireCustomEvent('FusionHeadless.Restart')
+    elif arg.path == "/batch":
+        arg.result = dispatch_batch(arg)
+    else:
+        handler = routes.get_handler(arg.path)
+        if handler:
+            if route_flag(arg.path, "cache", arg.query):
+                result_cache.prepare(arg)
+            args = handler.__code__.co_varnames[:handler.__code__.co_argcount]
+            kwargs = {k: v for k, v in arg.context.items() if k in args}
+            arg.result = handler(**kwargs)
+        else:
+            arg.http_error = (404, f"Route {arg.path} not defined")
+
+def dispatch_batch(arg:CustomEventArgument) -> list|None:
+    """Runs the sub-requests of a /batch call in order within the current UI-thread dispatch. A malformed
+    'requests' fails the whole batch with 400, a malformed item only its own entry."""
+    requests = arg.query.get("requests", [])
+    if isinstance(requests, str):
         try:
-            arg = customEventArguments.get(args.additionalInfo, None)
-            if not arg:
-                return  # If the argument is not found, do nothing
-            elif arg.path == "/eval" or arg.path == "/exec":
-                # evaluate or execute are low-level operations so a running server can be recovered
-                if arg.path == "/eval":
-                    arg.result = eval(arg.query.get("code", ""), arg.context)
-                elif arg.path == "/exec":
-                    exec(arg.query.get("code", ""), arg.context)
-                    arg.result = arg.context.get("result", None)
-
-                if "depth" in arg.query:
-                    arg.result = object2json(arg.result, max_depth=int(arg.query["depth"]))
-            elif arg.path == "/restart" or arg.path == "/reload":
-                # restart and reload are low-level operations so a running server can be recovered
-                modules = {x: getattr(sys.modules.get(x), '__file__', None) for x in sorted(sys.modules)}
-                my_modules = {k: v for k, v in modules.items() if v is not None and "FusionHeadless" in v}
-
-                arg.result = {}
-                for module in my_modules:
-                    if module == "server":
-                        continue
+            requests = json.loads(requests)
+        except json.JSONDecodeError:
+            requests = None
+    if not isinstance(requests, list):
+        arg.http_error = (400, "/batch expects 'requests' to be a list of {path, query} objects.")
+        return None
+    stop_on_error = str(arg.query.get("stopOnError", False)).lower() in ("true", "1", "yes", "on")
 
-                    try:
-                        importlib.reload(sys.modules[module])
-                        arg.result[module] = "Reloaded"
-                    except Exception:
-                        del sys.modules[module]
-                        arg.result[module] = "Removed"
+    results = []
+    for item in requests:
+        path = item.get("path", "") if isinstance(item, dict) else None
+        query = (item.get("query", None) or {}) if isinstance(item, dict) else None
+        if not isinstance(path, str) or not isinstance(query, dict):
+            results.append({"path": path, "status": "error", "code": 400, "error": "Batched requests must be {path, query} objects with an object query."})
+        elif path == "/batch":
+            results.append({"path": path, "status": "error", "code": 400, "error": "/batch cannot be nested."})
+        else:
+            sub = CustomEventArgument(path, query, None)
+            try:
+                sub.select = parse_select(query.pop("select", None))
+            except ValueError as e:
+                sub.http_error = (400, str(e))
+            if not sub.http_error:
+                sub.context = get_context({ "path": path, "query": query, "request": query, "select": sub.select })
+                try:
+                    dispatch(sub)
+                    sub.result = project(sub.result, sub.select)
+                except Exception:
+                    sub.http_error = (500, traceback.format_exc())
 
-                if arg.path == "/restart":
-                    arg.result["server"] = "Restarting.."
-                    app.fireCustomEvent('FusionHeadless.Restart')
-            else:
-                handler = routes.get_handler(arg.path)
-                if handler:
-                    args = handler.__code__.co_varnames[:handler.__code__.co_argcount]
-                    kwargs = {k: v for k, v in arg.context.items() if k in args}
-                    arg.result = handler(**kwargs)
+            if not sub.http_error and is_http_response(sub.result):
+                if sub.result.headers.get("Content-Type") == "application/json":
+                    sub.result = json.loads(sub.result.get_content())
                 else:
-                    arg.http_error = (404, f"Route {arg.path} not defined")
+                    discard_result(sub)
+                    sub.http_error = (400, f"Route {path} returns '{sub.result.headers.get('Content-Type')}' which cannot be batched.")
+
+            if sub.http_error:
+                results.append({"path": path, "status": "error", "code": sub.http_error[0], "error": sub.http_error[1]})
+            else:
+                results.append({"path": path, "status": "ok", "result": sub.result})
+
+        if stop_on_error and results[-1]["status"] == "error":
+            break
+    return results
+
+def call_on_ui_thread(func) -> any:
+    """Runs func on the UI thread through the work queue and waits for its result."""
+    arg = CustomEventArgument(None, {}, None, func=func)
+    work_queue.put(arg)
+    arg.event.wait()
+    if arg.http_error:
+        raise Exception(arg.http_error[1])
+    return arg.result
+
+def iterate_on_ui_thread(iterator) -> any:
+    """Yields the items of iterator, advancing it on the UI thread in batches bounded by STREAM_BATCH_SIZE and DRAIN_TIME_BUDGET."""
+    def pull():
+        items = []
+        start = time.perf_counter()
+        for item in iterator:
+            items.append(item)
+            if len(items) >= STREAM_BATCH_SIZE or time.perf_counter() - start > DRAIN_TIME_BUDGET:
+                return items, False
+        return items, True
+
+    done = False
+    while not done:
+        items, done = call_on_ui_thread(pull)
+        yield from items
+
+class StreamJson(Exception):
+    """Raised by json_default when a value must be walked by iter_json instead of the C encoder."""
+
+def json_default(obj):
+    if isinstance(obj, ServerStatus):
+        return obj.snapshot()
+    if isinstance(obj, collections.abc.Iterator):
+        raise StreamJson()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+json_encoder = json.JSONEncoder(default=json_default)
+
+def iter_json(obj) -> any:
+    """Encodes obj as JSON in pieces. Containers are encoded STREAM_ENCODE_BATCH items per call of the
+    C encoder; only batches holding iterators (e.g. generators returned by handlers) are walked item by
+    item, and iterators are pulled on the UI thread and streamed as arrays without being materialized."""
+    if isinstance(obj, collections.abc.Iterator):
+        yield "["
+        items = iterate_on_ui_thread(obj)
+        separator = ""
+        while batch := list(itertools.islice(items, STREAM_ENCODE_BATCH)):
+            yield separator
+            yield from iter_json_batch(batch)
+            separator = ", "
+        yield "]"
+    elif isinstance(obj, (list, tuple)):
+        yield "["
+        for i in range(0, len(obj), STREAM_ENCODE_BATCH):
+            if i:
+                yield ", "
+            yield from iter_json_batch(obj[i:i + STREAM_ENCODE_BATCH])
+        yield "]"
+    elif isinstance(obj, dict):
+        yield "{"
+        entries = iter(obj.items())
+        separator = ""
+        while batch := dict(itertools.islice(entries, STREAM_ENCODE_BATCH)):
+            yield separator
+            yield from iter_json_batch(batch)
+            separator = ", "
+        yield "}"
+    else:
+        yield json_encoder.encode(obj)
 
-            arg.event.set()  # Signal that the code execution is complete
+def iter_json_batch(batch:list|tuple|dict) -> any:
+    """Encodes the items of one batch without the surrounding brackets, piecewise if it holds an iterator."""
+    try:
+        yield json_encoder.encode(batch)[1:-1]
+        return
+    except StreamJson:
+        pass
+    separator = ""
+    if not isinstance(batch, dict):
+        for item in batch:
+            yield separator
+            yield from iter_json(item)
+            separator = ", "
+    else:
+        for k, v in batch.items():
+            key = k if isinstance(k, str) else json_encoder.encode(k)
+            yield f"{separator}{json.encoder.encode_basestring_ascii(key)}: "
+            yield from iter_json(v)
+            separator = ", "
+
+def iter_json_blocks(obj) -> any:
+    """Groups the pieces of iter_json into encoded blocks of at least STREAM_BUFFER_SIZE bytes."""
+    buffer = []
+    size = 0
+    for part in iter_json(obj):
+        buffer.append(part)
+        size += len(part)
+        if size >= STREAM_BUFFER_SIZE:
+            yield "".join(buffer).encode()
+            buffer = []
+            size = 0
+    yield "".join(buffer).encode()
+
+def compress_blocks(encoding:str, blocks) -> any:
+    """Compresses an iterable of byte blocks incrementally with gzip or (zlib-wrapped) deflate."""
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31 if encoding == "gzip" else 15)
+    for block in blocks:
+        view = memoryview(block)
+        for i in range(0, len(view), 64 * 1024):
+            data = compressor.compress(view[i:i + 64 * 1024])
+            if data:
+                yield data
+    yield compressor.flush()
+
+class ExecOnUiThreadHandler(adsk.core.CustomEventHandler):
+    def __init__(self):
+        super().__init__()
+        describe_fusion()  # created by the add-in's run() on the UI thread
+    def notify(self, args):
+        global ui
+        start = time.perf_counter()
+        try:
+            if not fusion_info:
+                describe_fusion()  # the server module was reloaded by /restart
+            while True:
+                arg = work_queue.get()
+                if arg is None:
+                    break
+                self.execute(arg)
+                if time.perf_counter() - start > DRAIN_TIME_BUDGET:
+                    break  # give Fusion's event loop a turn, remaining work is picked up by the next event
         except Exception:
-            if arg:
-                arg.result = None
-                arg.http_error = (500, traceback.format_exc())
-                arg.event.set()  # Signal that the code execution is complete
-            elif ui:
+            if ui:
                 ui.messageBox('Failed:\n{}'.format(traceback.format_exc()))
             adsk.autoTerminate(False)
+        finally:
+            if work_queue.finish_drain():
+                app.fireCustomEvent('FusionHeadless.ExecOnUiThread')
+
+    @staticmethod
+    def execute(arg:CustomEventArgument):
+        """Runs a request, on the UI thread or, for routes registered with http_thread=True, on an HTTP thread."""
+        arg.started = time.monotonic()
+        try:
+            if arg.profile:
+                profiles.run(arg, dispatch)
+            else:
+                dispatch(arg)
+            if arg.context and arg.context.get("job") is not None:
+                # a job's result is fetched later, maybe repeatedly, so its generators run now, on this thread
+                arg.result = materialize(arg.result)
+        except Exception:
+            arg.result = None
+            arg.http_error = (500, traceback.format_exc())
+        if may_modify(arg):
+            result_cache.invalidate()
+            publish_change("request", path=arg.path)
+        arg.finished = time.monotonic()
+        arg.done()  # Signal that the code execution is complete
+        if arg.abandoned:
+            discard_result(arg)
+
+yielding = False
+def yield_ui_thread(budget:float=DRAIN_TIME_BUDGET) -> int:
+    """Called by long-running handlers between steps (injected as yield_ui): runs queued interactive requests on the
+    UI thread for up to budget seconds, so they need not wait for the handler to finish. Returns how many ran."""
+    global yielding
+    if yielding:
+        return 0  # an interactive request that yields itself
+    try:
+        asyncio.get_running_loop()
+        return 0  # called from a coroutine: a request run now could not use asyncio.run
+    except RuntimeError:
+        pass
+    yielding = True
+    count = 0
+    start = time.perf_counter()
+    try:
+        while time.perf_counter() - start < budget:
+            arg = work_queue.get(PRIORITIES[:1])
+            if arg is None:
+                break
+            ExecOnUiThreadHandler.execute(arg)
+            count += 1
+    finally:
+        yielding = False
+    with work_queue.lock:
+        work_queue.yielded += count
+    return count
+
+class MeteredWriter:
+    """Wraps a handler's wfile, accumulating the bytes written and the time spent writing them."""
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def write(self, data):
+        start = time.monotonic()
+        result = self.wfile.write(data)
+        self.seconds += time.monotonic() - start
+        self.bytes += len(data)
+        return result
+
+    def reset(self):
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.wfile, name)
 
 class RequestHandler(BaseHTTPRequestHandler):
-    def _do_ANY(self, request):
-        global app, customEventArguments
+    protocol_version = "HTTP/1.1"
+    timeout = KEEP_ALIVE_TIMEOUT  # idle keep-alive connections are closed after this many seconds
+    max_requests = KEEP_ALIVE_MAX_REQUESTS
+
+    def setup(self):
+        super().setup()
+        self.wfile = MeteredWriter(self.wfile)
+        self.metered_path = None
+        self.requests_handled = 0
+        self.start_request()
+
+    def start_request(self):
+        """Resets the per-request state of a (keep-alive) connection once a request line has arrived."""
+        self.parse_started = time.monotonic()
+        self.request_id = str(uuid.uuid4())
+        self.current_arg = None
+        self.extra_headers = []
+        self.status_code = None
+        self.send_started = None
+        self.chunked = False
+
+    def parse_request(self):
+        self.start_request()
+        if not super().parse_request():
+            return False
+        self.adopt_request_id()
+        return True
+
+    def adopt_request_id(self):
+        """Uses the client's X-Request-Id, if it is a safe token, so client and server logs correlate."""
+        value = self.headers.get("X-Request-Id", "")
+        if re.fullmatch(r"[A-Za-z0-9._-]{1,128}", value):
+            self.request_id = value
+
+    def server_timing(self, final:bool=False) -> str:
+        """Server-Timing value in milliseconds. Sending is only known once the body is written, so it is
+        reported in the trailer of chunked responses (final=True) and in /metrics."""
+        now = time.monotonic()
+        arg = self.current_arg
+        phases = []
+        if not final:
+            phases.append(("parse", (arg.queued if arg is not None and arg.queued else now) - self.parse_started))
+            if arg is not None and arg.started is not None:
+                phases.append(("queue", arg.started - arg.queued))
+                if arg.finished is not None:
+                    phases.append(("handler", arg.finished - arg.started))
+        if self.send_started is not None:
+            phases.append(("serialize", now - self.send_started - self.wfile.seconds))
+        if final:
+            phases.append(("send", self.wfile.seconds))
+        return ", ".join(f"{name};dur={max(0.0, seconds) * 1000:.3f}" for name, seconds in phases)
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == "transfer-encoding" and str(value).lower() == "chunked":
+            self.chunked = True
+        super().send_header(keyword, value)
+
+    def end_headers(self):
+        if self.status_code is not None:  # not for interim responses such as 100 Continue
+            self.send_header("X-Request-Id", self.request_id)
+            self.send_header("Server-Timing", self.server_timing())
+            if self.chunked:
+                self.send_header("Trailer", "Server-Timing")
+            for name, value in self.extra_headers:
+                self.send_header(name, value)
+        super().end_headers()
+
+    def end_chunks(self):
+        """Terminates a chunked body, adding the final serialize and send timings as a trailer."""
+        self.wfile.write(b"0\r\nServer-Timing: %s\r\n\r\n" % self.server_timing(final=True).encode())
+
+    def send_response(self, code, message=None):
+        self.status_code = code
+        super().send_response(code, message)
+        self.requests_handled += 1
+        if self.requests_handled >= self.max_requests:
+            self.close_connection = True
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        else:
+            self.send_header("Connection", "keep-alive")
+            self.send_header("Keep-Alive", f"timeout={self.timeout}, max={self.max_requests - self.requests_handled}")
+
+    def accepted_encoding(self) -> str|None:
+        """Picks gzip or deflate from the request's Accept-Encoding, honoring q-values."""
+        best, best_q = None, 0.0
+        for item in self.headers.get("Accept-Encoding", "").split(","):
+            name, _, params = item.strip().partition(";")
+            name = name.strip().lower()
+            try:
+                q = float(params.strip()[2:]) if params.strip().startswith("q=") else 1.0
+            except ValueError:
+                q = 0.0
+            if name == "*":
+                name = "gzip"
+            if name in ("gzip", "deflate") and q > best_q:
+                best, best_q = name, q
+        return best
+
+    def encode_body(self, content_type:str|None, content:bytes|object) -> tuple[str|None, bytes|object]:
+        """Negotiates the Content-Encoding for a body. Returns the chosen encoding, or None, and the body
+        which, when compressed, is a generator so compression happens incrementally while sending."""
+        encoding = self.accepted_encoding()
+        if encoding is None or (content_type or "").split(";")[0].strip() in COMPRESSED_TYPES:
+            return None, content
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            if len(content) < COMPRESS_MIN_SIZE or bytes(content[:4]).startswith(COMPRESSED_MAGIC):
+                return None, content
+            content = [content]
+        return encoding, compress_blocks(encoding, content)
+
+    def get_deadline(self, path:str) -> float:
+        """Returns the monotonic deadline from X-Deadline (seconds from now, or an absolute Unix time) or the route's default."""
+        value = self.headers.get("X-Deadline")
+        if value:
+            seconds = float(value)
+            if not math.isfinite(seconds):
+                raise ValueError(f"X-Deadline must be finite, got {value!r}")
+            if seconds > 1e9:
+                seconds -= time.time()
+        else:
+            seconds = route_options(path).get("deadline", DEFAULT_DEADLINE)
+        return time.monotonic() + seconds
+
+    def send_unavailable(self, status:int, message:str):
+        self.send_response(status)
+        self.send_header("Retry-After", str(RETRY_AFTER))
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(message.encode())))
+        self.end_headers()
+        self.wfile.write(message.encode())
+
+    def send_bytes(self, status:int, content_type:str, content:bytes):
+        self.send_encoded(status, content_type, *self.encode_body(content_type, content))
+
+    def send_encoded(self, status:int, content_type:str, encoding:str|None, content:bytes|object):
+        """Sends a body as returned by encode_body, with its Content-Length."""
+        if encoding:
+            content = b"".join(content)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+            self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        view = memoryview(content)
+        for i in range(0, len(view), 64 * 1024):
+            self.wfile.write(view[i:i + 64 * 1024])  # a single large sendall would be bound by the socket timeout
+
+    def send_file(self, status:int, headers:dict, path:str):
+        """Sends the file of a FileResponse. Small files are read and compressed like other bodies, larger ones are
+        compressed while being read if the client accepts it, and otherwise passed to the kernel with os.sendfile."""
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            content_type = headers.pop("Content-Type", "application/octet-stream")
+            if size < SENDFILE_MIN_SIZE:
+                self.extra_headers += headers.items()
+                return self.send_bytes(status, content_type, file.read())
+            encoding = self.file_encoding(content_type, file, size)
+            if encoding:
+                self.extra_headers += headers.items()
+                return self.send_file_compressed(status, content_type, encoding, file)
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            self.write_file(file, 0, size)
+
+    def send_artifact(self, artifact:types.SimpleNamespace):
+        """Sends an artifact, or the single byte range the request asks for uncompressed with os.sendfile. Whole
+        artifacts are compressed while being read if the client accepts it; ranges always refer to the identity bytes."""
+        etag = f'"{artifact.id}"'
+        self.extra_headers += [("X-Artifact-Id", artifact.id), ("Accept-Ranges", "bytes")]
+        try:
+            span = parse_range(self.headers.get("Range"), artifact.size) if self.headers.get("If-Range", etag) == etag else None
+        except ValueError:
+            self.extra_headers += [("ETag", etag), ("Content-Range", f"bytes */{artifact.size}")]
+            return self.send_bytes(416, "text/plain", b"Range not satisfiable.")
+        first, last = span or (0, artifact.size - 1)
+        try:
+            file = open(artifact.path, "rb")
+        except FileNotFoundError:
+            return self.send_bytes(404, "text/plain", f"Artifact '{artifact.id}' expired.".encode())
+        with file:
+            encoding = None if span else self.file_encoding(artifact.content_type, file, artifact.size)
+            if encoding:
+                self.extra_headers.append(("ETag", f'"{artifact.id}-{encoding}"'))  # a different representation
+                return self.send_file_compressed(200, artifact.content_type, encoding, file)
+            self.extra_headers.append(("ETag", etag))
+            self.send_response(206 if span else 200)
+            self.send_header("Content-Type", artifact.content_type)
+            if span:
+                self.send_header("Content-Range", f"bytes {first}-{last}/{artifact.size}")
+            self.send_header("Content-Length", str(last - first + 1))
+            self.end_headers()
+            self.write_file(file, first, last - first + 1)
+
+    def file_encoding(self, content_type:str, file, size:int) -> str|None:
+        """Negotiates the Content-Encoding for a file on disk, like encode_body does for bodies in memory."""
+        encoding = self.accepted_encoding()
+        if encoding is None or size < COMPRESS_MIN_SIZE or content_type.split(";")[0].strip() in COMPRESSED_TYPES:
+            return None
+        head = file.read(4)
+        file.seek(0)
+        return None if head.startswith(COMPRESSED_MAGIC) else encoding
+
+    def send_file_compressed(self, status:int, content_type:str, encoding:str, file):
+        """Streams a file through compress_blocks on this thread, chunked since the compressed size is not known up front."""
+        chunked = self.request_version == "HTTP/1.1"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Encoding", encoding)
+        self.send_header("Vary", "Accept-Encoding")
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.close_connection = True
+        self.end_headers()
+        for block in compress_blocks(encoding, iter(lambda: file.read(SENDFILE_MIN_SIZE), b"")):
+            self.write_chunk(block, chunked)
+        if chunked:
+            self.end_chunks()
+
+    def write_file(self, file, offset:int, count:int):
+        """Writes part of a file to the connection, metered like writes to wfile."""
+        if count <= 0:
+            return
+        start = time.monotonic()
+        try:
+            self.wfile.bytes += self.sendfile(file, offset, count)
+        finally:
+            self.wfile.seconds += time.monotonic() - start
+
+    def sendfile(self, file, offset:int, count:int) -> int:
+        """Writes count bytes of file from offset to the connection, returns the number of bytes sent.
+        socket.sendfile uses os.sendfile where available and falls back to chunked reads otherwise."""
+        return self.connection.sendfile(file, offset, count)
+
+    def send_json(self, status:int, obj:any):
+        """Sends obj as JSON, switching to chunked transfer encoding once STREAM_BUFFER_SIZE is exceeded."""
+        blocks = iter_json_blocks(obj)
+        first = next(blocks, b"")
+        if len(first) < STREAM_BUFFER_SIZE:
+            return self.send_bytes(status, "application/json", first)  # everything fit into one block
+        self.send_json_blocks(status, itertools.chain([first], blocks))
+
+    def send_json_blocks(self, status:int, blocks) -> bool:
+        """Streams encoded JSON blocks chunked, compressed if negotiated. Returns False if the response was cut short."""
+        chunked = self.request_version == "HTTP/1.1"
+        encoding, body = self.encode_body("application/json", blocks)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+            self.send_header("Vary", "Accept-Encoding")
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.close_connection = True
+        self.end_headers()
+        try:
+            for block in body:
+                self.write_chunk(block, chunked)
+        except Exception:
+            # the status line is already sent; abort the response so the client sees a truncated transfer
+            self.log_error("Streaming response failed:\n%s", traceback.format_exc())
+            self.close_connection = True
+            return False
+        if chunked:
+            self.end_chunks()
+        return True
+
+    def uses_etag(self, arg:CustomEventArgument) -> bool:
+        """True for GET requests to routes registered with etag=True, or etag=predicate(query) returning True."""
+        return self.command == "GET" and route_flag(arg.path, "etag", arg.query)
+
+    @staticmethod
+    def body_etag(body:bytes) -> str:
+        return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+    def send_json_etag(self, status:int, obj:any, arg:CustomEventArgument|None=None):
+        """Sends obj as JSON with a strong ETag hashed from the encoded body, storing it in the result cache if arg
+        has a cache key. Bodies larger than one STREAM_BUFFER_SIZE block are streamed without an ETag instead of
+        being buffered; a cached route's body is collected while streaming, so later cache hits carry the ETag."""
+        blocks = iter_json_blocks(obj)
+        first = next(blocks, b"")
+        cache = arg is not None and arg.cache_key is not None
+        if len(first) < STREAM_BUFFER_SIZE:
+            etag = self.body_etag(first)
+            if cache:
+                result_cache.put(arg, first, etag)
+            return self.send_etagged(status, first, etag)
+
+        collected = []
+        def collect(blocks):
+            nonlocal cache
+            size = 0
+            for block in blocks:
+                if cache:
+                    size += len(block)
+                    collected.append(block)
+                    if size > CACHE_MAX_BYTES // 4:
+                        cache = False  # too large to be cached
+                        collected.clear()
+                yield block
+        if self.send_json_blocks(status, collect(itertools.chain([first], blocks))) and cache:
+            body = b"".join(collected)
+            result_cache.put(arg, body, self.body_etag(body))
+
+    def send_etagged(self, status:int, body:bytes, etag:str):
+        """Sends a JSON body with its ETag, or 304 without a body if it matches If-None-Match. A strong ETag must
+        differ between content codings, so compressed bodies carry the tag with the coding appended."""
+        encoding, content = self.encode_body("application/json", body)
+        if encoding:
+            etag = f'{etag[:-1]}-{encoding}"'
+        else:
+            self.extra_headers.append(("Vary", "Accept-Encoding"))  # send_encoded adds it to compressed bodies
+        self.extra_headers += [("ETag", etag), ("Cache-Control", "no-cache")]
+        tags = [x.strip() for x in self.headers.get("If-None-Match", "").split(",")]
+        if etag in tags or f"W/{etag}" in tags or "*" in tags:
+            if encoding:
+                self.extra_headers.append(("Vary", "Accept-Encoding"))
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_encoded(status, "application/json", encoding, content)
+
+    def write_chunk(self, content:bytes, chunked:bool):
+        if not content:
+            return
+        elif chunked:
+            self.wfile.write(b"%X\r\n%s\r\n" % (len(content), content))
+        else:
+            self.wfile.write(content)
+
+    def read_body(self) -> bytes:
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if size == 0:
+                    while self.rfile.readline().strip():
+                        pass  # skip trailers
+                    return body
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length > 0 else b''
+
+    def prepare(self, request:dict, on_done=None) -> CustomEventArgument|None:
+        """Parses and admits a request. Returns the queued argument, or None if a response was already sent."""
+        global app
         parsed_url = urlparse(self.path)
         path = parsed_url.path
+        if path == "/metrics":
+            return self.send_bytes(200, "text/plain; version=0.0.4; charset=utf-8", metrics.render().encode())
+        self.begin_request(path)
         query = {k: v[0] if len(v) == 1 else v for k, v in parse_qs(parsed_url.query).items()}
         query.update(request)  # Merge query parameters with request body
-        context = get_context({ "path": path, "query": query, "request": request })
+        if path == "/artifacts":
+            return self.send_artifacts(query)
+        if path == "/jobs":
+            return self.handle_jobs(query)
+        try:
+            select = parse_select(query.pop("select", None))
+        except ValueError as e:
+            return self.send_bytes(400, "text/plain", str(e).encode())
+        profile = str(query.pop("profile", "")).lower()
+        try:
+            profile_top = int(query.pop("profileTop", PROFILE_TOP))
+        except ValueError:
+            return self.send_bytes(400, "text/plain", b"profileTop must be an integer.")
+        context = get_context({ "path": path, "query": query, "request": request, "select": select })
 
         arg = CustomEventArgument(path, query, context)
-        customEventArguments[arg.uuid] = arg
-        app.fireCustomEvent('FusionHeadless.ExecOnUiThread', arg.uuid)
-        arg.event.wait()  # Wait for the event to be set by the custom event handler
-        del customEventArguments[arg.uuid]  # Clean up after we're done
+        arg.uuid = self.request_id
+        arg.select = select
+        self.current_arg = arg
+        if profile in ("dump", "1", "true", "yes", "on"):
+            arg.profile = "dump" if profile == "dump" else "stats"
+            arg.profile_top = profile_top
+            self.extra_headers.append(("X-Profile-Id", arg.uuid))
+        arg.on_done = on_done
+        try:
+            arg.deadline = self.get_deadline(path)
+        except ValueError:
+            return self.send_bytes(400, "text/plain", f"Invalid X-Deadline header '{self.headers.get('X-Deadline')}'.".encode())
+        if arg.deadline <= time.monotonic():
+            return self.send_unavailable(504, "Deadline expired before the request was queued.")
+        arg.priority = self.headers.get("X-Priority") or route_options(path).get("priority", "normal")
+        if arg.priority not in PRIORITIES:
+            return self.send_bytes(400, "text/plain", f"Invalid X-Priority header '{arg.priority}', expected {', '.join(PRIORITIES)}.".encode())
+        if self.command == "GET" and not arg.profile and route_flag(path, "cache", query):
+            cached = result_cache.get(path, query, select)
+            self.extra_headers.append(("X-Cache", "hit" if cached else "miss"))
+            if cached:
+                # answered like a finished request, so the asyncio core compresses it off the event loop
+                arg.cached = cached
+                # the hit is the handler: zero queue wait and handler time, parse ends here
+                arg.queued = arg.started = arg.finished = time.monotonic()
+                arg.done()
+                return arg
+        if route_flag(path, "http_thread", query):
+            arg.http_thread = True
+            work_queue.bypass(arg)
+            self.run_off_ui_thread(arg)
+            return arg
+        if not work_queue.put(arg, limit=MAX_QUEUE_DEPTH):
+            return self.send_unavailable(503, f"Too many {arg.priority} requests are waiting for Fusion's UI thread (limit {MAX_QUEUE_DEPTH}).")
+        return arg
 
-        if arg.http_error:
-            self.send_response(arg.http_error[0])
+    def run_off_ui_thread(self, arg:CustomEventArgument):
+        """Runs a route that does not use the Fusion API right away, so it never waits behind a long render or export."""
+        ExecOnUiThreadHandler.execute(arg)
+
+    def send_artifacts(self, query:dict):
+        """/artifacts lists the kept artifacts, /artifacts?id=<id> downloads one; neither waits for the UI thread."""
+        if "id" not in query:
+            return self.send_json(200, {"status": "ok", "result": artifacts.list()})
+        artifact = artifacts.get(str(query["id"]))
+        if artifact is None:
+            return self.send_bytes(404, "text/plain", f"Artifact '{query['id']}' not found or expired.".encode())
+        self.send_artifact(artifact)
+
+    def handle_jobs(self, query:dict):
+        """POST /jobs {"path", "query"} submits a job, {"cancel": <id>} cancels one; GET /jobs lists them,
+        /jobs?id=<id> describes one and /jobs?id=<id>&result=1 sends its result once it is done."""
+        if ("path" in query or "cancel" in query) and self.command != "POST":
+            self.extra_headers.append(("Allow", "POST"))
+            return self.send_bytes(405, "text/plain", b"Jobs are submitted and cancelled with POST /jobs.")
+        if "path" in query:
+            if not isinstance(query.get("query") or {}, dict):
+                return self.send_bytes(400, "text/plain", b"The job's 'query' must be an object.")
+            return self.submit_job(str(query["path"]), dict(query.get("query") or {}))
+        key = query.get("cancel", query.get("id"))
+        if key is None:
+            return self.send_json(200, {"status": "ok", "result": jobs.list()})
+        job = jobs.get(str(key))
+        if job is None:
+            return self.send_bytes(404, "text/plain", f"Job '{key}' not found or expired.".encode())
+        if "cancel" in query:
+            jobs.cancel(job)
+            return self.send_json(200, {"status": "ok", "result": job.describe()})
+        if str(query.get("result", "")).lower() not in ("true", "1", "yes", "on"):
+            return self.send_json(200, {"status": "ok", "result": job.describe()})
+        if not job.arg.event.is_set():
+            self.extra_headers.append(("Retry-After", str(RETRY_AFTER)))
+            return self.send_json(202, {"status": "ok", "result": job.describe()})
+        self.current_arg = job.arg
+        if is_http_response(job.arg.result) and hasattr(job.arg.result, "path"):
+            with jobs.lock:
+                if job.artifact is None:
+                    try:
+                        job.artifact = artifacts.add(job.arg.result)
+                    finally:
+                        job.arg.result.discard()
+            return self.send_artifact(job.artifact)
+        self.send_result(job.arg)
+
+    def submit_job(self, path:str, query:dict):
+        if path not in routes.routes and not route_options(path).get("job"):
+            return self.send_bytes(404, "text/plain", f"Route {path} not found.".encode())
+        try:
+            select = parse_select(query.pop("select", None))
+        except ValueError as e:
+            return self.send_bytes(400, "text/plain", str(e).encode())
+        job = Job()
+        arg = CustomEventArgument(path, query, get_context({ "path": path, "query": query, "request": query, "select": select, "job": job }))
+        arg.select = select
+        arg.priority = self.headers.get("X-Priority") or route_options(path).get("priority", "normal")
+        if arg.priority not in PRIORITIES:
+            return self.send_bytes(400, "text/plain", f"Invalid X-Priority header '{arg.priority}', expected {', '.join(PRIORITIES)}.".encode())
+        arg.on_done = lambda: jobs.finished(job)  # no deadline, jobs wait until they run or are cancelled
+        job.arg = arg
+        if not jobs.add(job):
+            return self.send_unavailable(503, f"Too many jobs (limit {MAX_JOBS}), cancel finished ones to free their slots.")
+        if not work_queue.put(arg, limit=MAX_QUEUE_DEPTH):
+            jobs.remove(job)
+            return self.send_unavailable(503, f"Too many {arg.priority} requests are waiting for Fusion's UI thread (limit {MAX_QUEUE_DEPTH}).")
+        self.extra_headers.append(("Location", f"/jobs?id={job.id}"))
+        self.send_json(202, {"status": "ok", "result": job.describe()})
+
+    def begin_request(self, path:str):
+        """Starts the metrics of a request; end_request must follow once the response is sent."""
+        self.metered_path = path
+        self.wfile.reset()
+        metrics.begin()
+
+    def end_request(self, arg:CustomEventArgument|None):
+        if self.metered_path is None:
+            return  # /metrics or rejected before parsing
+        phases = {"send": self.wfile.seconds}
+        if arg is not None and arg.started is not None:
+            phases["queue_wait"] = arg.started - arg.queued
+            if arg.finished is not None:
+                phases["handler"] = arg.finished - arg.started
+        if self.send_started is not None:
+            phases["serialize"] = time.monotonic() - self.send_started - self.wfile.seconds
+        metrics.end(self.metered_path, self.status_code, self.wfile.bytes, phases)
+        self.metered_path = None
+
+    def send_timeout(self, arg:CustomEventArgument):
+        # still queued requests are dropped when drained, a running one finishes but its result is discarded
+        with work_queue.lock:
+            work_queue.timed_out += 1
+        arg.abandoned = True
+        if arg.event.is_set():
+            discard_result(arg)  # finished while the timeout was being handled
+        self.send_unavailable(504, f"Fusion did not complete {arg.path} before the deadline.")
+
+    def send_result(self, arg:CustomEventArgument):
+        self.send_started = time.monotonic()
+        if arg.cached is not None:
+            self.send_etagged(200, *arg.cached)
+        elif arg.http_error:
             message = arg.http_error[1]
             if isinstance(message, str):
-                self.send_header("Content-Type", "text/plain")
-                self.end_headers()
-                self.wfile.write(message.encode())
+                self.send_bytes(arg.http_error[0], "text/plain", message.encode())
             else:
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps(message).encode())
-            self.send_error(arg.http_error[0], arg.http_error[1])
-        elif hasattr(arg.result, 'send') and callable(getattr(arg.result, 'send')):
+                self.send_bytes(arg.http_error[0], "application/json", json.dumps(message).encode())
+        elif is_http_response(arg.result) and hasattr(arg.result, "path") and route_flag(arg.path, "artifacts", arg.query):
+            try:
+                artifact = artifacts.add(arg.result)
+            finally:
+                arg.result.discard()
+            self.send_artifact(artifact)
+        elif is_http_response(arg.result):
             arg.result.send(self)
         else:
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps({
-                "status": "ok",
-                "result": arg.result
-            }).encode())
+            try:
+                response = {
+                    "status": "ok",
+                    "result": project(arg.result, arg.select)
+                }
+                if arg.profile:
+                    response["profile"] = profiles.get(arg.uuid)
+                if self.uses_etag(arg) or arg.cache_key is not None:
+                    self.send_json_etag(200, response, arg)
+                else:
+                    self.send_json(200, response)
+            except Exception:
+                self.send_bytes(500, "text/plain", traceback.format_exc().encode())
+
+    def open_events(self, wake) -> EventSubscriber|None:
+        """Subscribes an /events request filtered by ?types=saved,closed and ?document=<id> and sends the headers
+        of the text/event-stream. Returns None if an error response was sent instead."""
+        query = parse_qs(urlparse(self.path).query)
+        types = set(x for value in query.get("types", []) for x in value.split(",") if x) or None
+        if types is not None and not types.issubset(EVENT_TYPES):
+            return self.send_bytes(400, "text/plain", f"Unknown event types {sorted(types - set(EVENT_TYPES))}, expected {', '.join(EVENT_TYPES)}.".encode())
+        last_id = self.headers.get("Last-Event-ID") or query.get("lastEventId", [None])[0]
+        try:
+            last_id = int(last_id) if last_id else None
+        except ValueError:
+            last_id = 0  # not one of ours, resync
+        subscriber = event_bus.subscribe(types, query.get("document", [None])[0], wake, last_id)
+        if subscriber is None:
+            return self.send_unavailable(503, f"Too many /events clients (limit {MAX_EVENT_CLIENTS}).")
+        self.close_connection = True  # the stream ends with the connection
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(b"retry: 3000\n\n")
+        if subscriber.events or subscriber.dropped:
+            wake()  # replayed events
+        return subscriber
+
+    def write_events(self, subscriber:EventSubscriber):
+        """Writes the subscriber's buffered events, preceded by a resync event if some were dropped, or a
+        keep-alive comment if there are none."""
+        events, dropped = event_bus.take(subscriber)
+        lines = []
+        if dropped:
+            lines.append(b"event: resync\ndata: %s\n\n" % json.dumps({"type": "resync", "dropped": dropped}).encode())
+        for event in events:
+            lines.append(b"id: %d\nevent: %s\ndata: %s\n\n" % (event["id"], event["type"].encode(), json.dumps(event).encode()))
+        self.wfile.write(b"".join(lines) or b": keep-alive\n\n")
+
+    def serve_events(self):
+        woken = threading.Event()
+        subscriber = self.open_events(woken.set)
+        if subscriber is None:
+            return
+        try:
+            while not subscriber.closed:
+                woken.wait(EVENT_HEARTBEAT)
+                woken.clear()
+                self.write_events(subscriber)
+        except OSError:
+            pass  # client disconnected
+        finally:
+            event_bus.unsubscribe(subscriber)
+
+    def _do_ANY(self, request):
+        if urlparse(self.path).path == "/events":
+            return self.serve_events()
+        arg = None
+        try:
+            arg = self.prepare(request)
+            if arg is None:
+                return
+            if not arg.event.wait(timeout=arg.deadline - time.monotonic()):  # Wait for the event to be set by the custom event handler
+                return self.send_timeout(arg)
+            self.send_result(arg)
+        finally:
+            self.end_request(arg)
+
+    @staticmethod
+    def parse_body(body:bytes) -> dict:
+        try:
+            return json.loads(body)
+        except json.JSONDecodeError:
+            return {}
 
     def do_GET(self):
+        self.read_body()  # drain an unexpected body so the next request on this connection parses
         return self._do_ANY({})
 
     def do_POST(self):
+        return self._do_ANY(self.parse_body(self.read_body()))
+
+class HeadlessHTTPServer(ThreadingHTTPServer):
+    request_queue_size = 128  # the default listen backlog of 5 resets connections under bursts
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connections = threading.BoundedSemaphore(MAX_CONNECTIONS)
+
+    def process_request(self, request, client_address):
+        if not self.connections.acquire(blocking=False):
+            # refuse instead of spawning yet another thread that would wait for the UI thread
+            try:
+                message = b"Too many connections."
+                request.sendall(b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: %d\r\nContent-Type: text/plain\r\nContent-Length: %d\r\nConnection: close\r\n\r\n%s" % (RETRY_AFTER, len(message), message))
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        super().process_request(request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.connections.release()
+
+class AsyncWriter:
+    """wfile for AsyncRequestHandler. Writes from the event loop are buffered by the transport, writes from
+    an executor thread are handed to the loop and wait for the transport to drain (flow control). Like the
+    socket timeout of the threading core, a client that reads nothing for KEEP_ALIVE_TIMEOUT seconds has its
+    connection aborted, so it cannot hold an executor thread forever."""
+    def __init__(self, loop:asyncio.AbstractEventLoop, writer:asyncio.StreamWriter):
+        self.loop = loop
+        self.writer = writer
+        self.loop_thread = threading.get_ident()
+
+    async def write_and_drain(self, data:bytes):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def write(self, data):
+        if threading.get_ident() == self.loop_thread:
+            self.writer.write(bytes(data))
+        else:
+            self.wait(self.write_and_drain(bytes(data)))
+
+    def wait(self, coroutine) -> any:
+        """Runs coroutine on the loop from an executor thread, aborting the connection if it stalls."""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        try:
+            return future.result(timeout=KEEP_ALIVE_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            self.loop.call_soon_threadsafe(self.writer.transport.abort)
+            raise ConnectionAbortedError(f"The client read nothing for {KEEP_ALIVE_TIMEOUT} seconds.")
+
+    def flush(self):
+        pass
+
+    async def drain(self):
+        await self.writer.drain()
+
+class AsyncRequestHandler(RequestHandler):
+    """RequestHandler driven by AsyncHTTPServer. The event loop parses the request and awaits the UI thread
+    through a future; only sending the result, which may stream or compress, borrows an executor thread."""
+    def __init__(self, server, reader:asyncio.StreamReader, writer:asyncio.StreamWriter, connection):
+        # BaseHTTPRequestHandler.__init__ would serve a blocking socket, only its per-request state is set up
+        self.server = server
+        self.reader = reader
+        self.connection_state = connection
+        self.client_address = writer.get_extra_info("peername") or ("localhost", 0)
+        self.writer = writer
+        self.wfile = MeteredWriter(AsyncWriter(server.loop, writer))
+        self.metered_path = None
+        self.start_request()
+        self.close_connection = True
+        self.body = b""
+
+    @property
+    def requests_handled(self) -> int:
+        return self.connection_state.requests_handled
+
+    @requests_handled.setter
+    def requests_handled(self, value:int):
+        self.connection_state.requests_handled = value
+
+    def parse_head(self, head:bytes) -> bool:
+        """Parses request line and headers like BaseHTTPRequestHandler.parse_request, sending 400 on errors."""
+        self.start_request()
+        self.command, self.path, self.request_version = None, "", "HTTP/0.9"
+        self.requestline, _, header_bytes = head.lstrip(b"\r\n").partition(b"\r\n")
+        self.requestline = self.requestline.decode("iso-8859-1")
+        words = self.requestline.split()
+        if len(words) != 3 or not words[2].startswith("HTTP/1."):
+            self.request_version = "HTTP/1.1"
+            self.send_error(400, f"Bad request syntax ({self.requestline!r})")
+            return False
+        self.command, self.path, self.request_version = words
+        self.headers = http.client.parse_headers(io.BytesIO(header_bytes))
+        self.adopt_request_id()
+
+        connection = self.headers.get("Connection", "").lower()
+        if connection == "close":
+            self.close_connection = True
+        elif connection == "keep-alive" or self.request_version == "HTTP/1.1":
+            self.close_connection = False
+        if self.headers.get("Expect", "").lower() == "100-continue" and self.request_version == "HTTP/1.1":
+            self.wfile.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+        return True
+
+    async def read_body_async(self) -> bytes:
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0].strip(), 16)
+                if size == 0:
+                    while (await self.reader.readline()).strip():
+                        pass  # skip trailers
+                    return body
+                body += await self.reader.readexactly(size)
+                await self.reader.readline()
         length = int(self.headers.get('Content-Length', 0))
-        body = self.rfile.read(length)
+        return await self.reader.readexactly(length) if length > 0 else b''
+
+    def read_body(self) -> bytes:
+        return self.body
+
+    def run_off_ui_thread(self, arg:CustomEventArgument):
+        self.server.loop.run_in_executor(self.server.direct_executor, ExecOnUiThreadHandler.execute, arg)
+
+    def sendfile(self, file, offset:int, count:int) -> int:
+        # called from an executor thread, the headers were already drained; loop.sendfile falls back to reads itself.
+        # Sent in pieces, so the send timeout applies to progress rather than to the whole file.
+        sent = 0
+        while sent < count:
+            piece = min(count - sent, SENDFILE_MIN_SIZE * 16)
+            sent += self.wfile.wait(self.server.loop.sendfile(self.writer.transport, file, offset + sent, piece))
+        return sent
+
+    async def serve_events_async(self):
+        """serve_events on the event loop: an idle stream costs neither a thread nor UI-thread time."""
+        loop = self.server.loop
+        woken = asyncio.Event()
+        subscriber = self.open_events(lambda: loop.call_soon_threadsafe(woken.set))
+        if subscriber is None:
+            return await self.wfile.drain()
         try:
-            request = json.loads(body)
-        except json.JSONDecodeError:
-            request = {}
+            while not subscriber.closed and not self.writer.is_closing() and not self.reader.at_eof():
+                try:
+                    await asyncio.wait_for(woken.wait(), EVENT_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    pass
+                woken.clear()
+                self.write_events(subscriber)
+                await self.wfile.drain()
+        except ConnectionError:
+            pass  # client disconnected
+        finally:
+            event_bus.unsubscribe(subscriber)
+
+    async def handle_async(self):
+        self.body = await self.read_body_async()
+        if self.command not in ("GET", "POST"):
+            self.send_error(501, f"Unsupported method ({self.command!r})")
+            return await self.wfile.drain()
+        if urlparse(self.path).path == "/events":
+            return await self.serve_events_async()
+
+        loop = self.server.loop
+        future = loop.create_future()
+        def resolve():
+            if not future.done():
+                future.set_result(None)
+        arg = None
+        request = {}
+        if self.command == "POST" and len(self.body) > STREAM_BUFFER_SIZE:
+            request = await loop.run_in_executor(self.server.direct_executor, self.parse_body, self.body)  # keeps the loop responsive
+        elif self.command == "POST":
+            request = self.parse_body(self.body)
+        try:
+            if urlparse(self.path).path in ("/artifacts", "/jobs"):
+                # answered without the UI thread, but reading and sending files must not block the loop
+                await loop.run_in_executor(self.server.direct_executor, self.prepare, request)
+            else:
+                arg = self.prepare(request, on_done=lambda: loop.call_soon_threadsafe(resolve))
+            if arg is not None:
+                try:
+                    await asyncio.wait_for(future, timeout=max(0, arg.deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    self.send_timeout(arg)
+                else:
+                    # results of http_thread routes, e.g. health checks, do not queue behind slow response writes
+                    executor = self.server.direct_executor if arg.http_thread else self.server.executor
+                    await loop.run_in_executor(executor, self.send_result, arg)
+            await self.wfile.drain()
+        finally:
+            self.end_request(arg)
 
-        return self._do_ANY(request)
+class AsyncHTTPServer:
+    """asyncio front end using only the standard library: connections are coroutines rather than OS
+    threads, so clients holding long keep-alive connections (e.g. MCP) cost no thread while idle."""
+    def __init__(self, server_address:tuple|None, RequestHandlerClass=AsyncRequestHandler, unix_socket:str|None=None):
+        self.server_address = server_address
+        self.unix_socket = unix_socket
+        self.RequestHandlerClass = RequestHandlerClass
+        self.loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(ASYNC_SEND_WORKERS, thread_name_prefix="FusionHeadless-send")
+        self.direct_executor = concurrent.futures.ThreadPoolExecutor(ASYNC_DIRECT_WORKERS, thread_name_prefix="FusionHeadless-direct")
+        self.writers = set()
+        self.stopped = threading.Event()
+        self.servers = []
+        if server_address is not None:
+            self.servers.append(self.loop.run_until_complete(asyncio.start_server(self.handle_connection, *server_address, backlog=128)))
+        if unix_socket is not None:
+            if os.path.exists(unix_socket) and stat.S_ISSOCK(os.stat(unix_socket).st_mode):
+                os.remove(unix_socket)  # left behind by a previous run that did not shut down cleanly
+            # restrict the socket before it listens: connecting needs a listening socket, so no other user can get in
+            # during the window the process-wide umask would otherwise have to cover
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.bind(unix_socket)
+                os.chmod(unix_socket, UNIX_SOCKET_MODE)
+                self.servers.append(self.loop.run_until_complete(asyncio.start_unix_server(self.handle_connection, sock=sock, backlog=128)))
+            except BaseException:
+                sock.close()
+                raise
 
-server:ThreadingHTTPServer = None
-def start_server(port=5000):
+    async def handle_connection(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        if len(self.writers) >= MAX_CONNECTIONS:
+            message = b"Too many connections."
+            writer.write(b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: %d\r\nContent-Type: text/plain\r\nContent-Length: %d\r\nConnection: close\r\n\r\n%s" % (RETRY_AFTER, len(message), message))
+            writer.close()
+            return
+
+        self.writers.add(writer)
+        connection = types.SimpleNamespace(requests_handled=0)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break  # idle timeout, client closed the connection or oversized headers
+
+                handler = self.RequestHandlerClass(self, reader, writer, connection)
+                if not handler.parse_head(head):
+                    await handler.wfile.drain()
+                    break
+                await handler.handle_async()
+                if handler.close_connection:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            pass  # server shutting down; ending normally keeps asyncio from reporting the cancelled connection
+        except Exception:
+            print(f"[FusionHeadless] Connection failed:\n{traceback.format_exc()}")
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    def serve_forever(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            for listener in self.servers:
+                listener.close()
+            for writer in list(self.writers):
+                writer.close()
+            for task in asyncio.all_tasks(self.loop):
+                task.cancel()
+            self.loop.run_until_complete(asyncio.sleep(0.1))  # let cancelled connections and transports close
+            self.loop.close()
+            self.stopped.set()
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.stopped.wait(timeout=10)
+
+    def server_close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.direct_executor.shutdown(wait=False, cancel_futures=True)
+        if self.unix_socket is not None and os.path.exists(self.unix_socket):
+            os.remove(self.unix_socket)
+
+server:ThreadingHTTPServer|AsyncHTTPServer = None
+def start_server(port=5000, core=SERVER_CORE, unix_socket=UNIX_SOCKET):
+    """Serves on localhost:port and/or the Unix domain socket unix_socket; port None disables TCP."""
     global server
-    server = ThreadingHTTPServer(("localhost", port), RequestHandler)
-    print(f"[FusionHeadless] Listening on port {port}")
+    if core == "asyncio":
+        server = AsyncHTTPServer(("localhost", port) if port is not None else None, unix_socket=unix_socket)
+    else:
+        if unix_socket is not None:
+            print("[FusionHeadless] Unix domain sockets require the asyncio core, serving TCP only")
+        server = HeadlessHTTPServer(("localhost", port), RequestHandler)
+        unix_socket = None
+    listening = ([f"port {port}"] if port is not None else []) + ([f"socket {unix_socket}"] if unix_socket is not None else [])
+    print(f"[FusionHeadless] Listening on {' and '.join(listening)} ({core})")
     server.serve_forever()
 
 def stop_server():
     global server
     if server:
         print("[FusionHeadless] Stopping server...")
+        event_bus.close()
+        artifacts.clear()
         server.shutdown()
         server.server_close()
         print("[FusionHeadless] Server stopped.")
\ No newline at end of file